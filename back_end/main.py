@@ -1,11 +1,35 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, BackgroundTasks, Query, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import pandas as pd
 import numpy as np
 import uuid
+import os
+import json
+from json.encoder import encode_basestring
+import base64
+import io
+import copy
+import hashlib
+import shutil
+import sqlite3
+import tempfile
+import time
+import asyncio
+import atexit
+import queue
+import random
 import logging
-from typing import List, Dict, Any, Optional
+import logging.handlers
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import PolynomialFeatures
 from sklearn.svm import SVR
@@ -15,14 +39,199 @@ from sklearn.metrics import mean_squared_error, r2_score
 import warnings
 warnings.filterwarnings('ignore')
 
+# 解析进程只导入这个无副作用的模块；以back_end.main导入（测试）或在back_end目录中以main运行时均可用
+try:
+    from .sheet_parser import read_excel_sheet
+except ImportError:
+    from sheet_parser import read_excel_sheet
+
+# 日志级别；DEBUG时才计算样本数据、类型列表等开销较大的诊断信息
+LOG_LEVEL = os.environ.get("DAPLOT_LOG_LEVEL", "INFO").upper()
+# 设置后以JSON行输出日志，并经队列交给后台线程写出，不占用请求处理时间
+LOG_JSON = os.environ.get("DAPLOT_LOG_JSON") == "1"
+# 各接口INFO/DEBUG日志的采样率，如 "filter=0.01,file=0.1"；接口名为filter、file、save、unique_values、predict、predict_direct，
+# 未列出的接口全部记录，警告和错误始终记录
+LOG_SAMPLE_RATES = {
+    endpoint.strip(): float(rate)
+    for endpoint, rate in (item.split("=", 1) for item in os.environ.get("DAPLOT_LOG_SAMPLE_RATES", "").split(",") if "=" in item)
+}
+
+# LogRecord自带的属性，其余属性（extra传入的字段）作为结构化字段输出
+_LOG_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+class JsonLogFormatter(logging.Formatter):
+    """
+    Formats a log record as one JSON object, including fields passed through `extra`.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _LOG_RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SampledLogger(logging.LoggerAdapter):
+    """
+    Logger for one request of an endpoint. INFO and DEBUG records are kept only for the sampled
+    fraction of requests set in LOG_SAMPLE_RATES; the endpoint is added as a structured field.
+    """
+    def __init__(self, logger: logging.Logger, endpoint: str):
+        super().__init__(logger, {"endpoint": endpoint})
+        rate = LOG_SAMPLE_RATES.get(endpoint, 1.0)
+        self.sampled = rate >= 1 or random.random() < rate
+
+    def isEnabledFor(self, level: int) -> bool:
+        # 未采样的请求在格式化消息之前就被丢弃
+        return (self.sampled or level >= logging.WARNING) and self.logger.isEnabledFor(level)
+
+    def process(self, msg, kwargs):
+        kwargs["extra"] = {**self.extra, **kwargs.get("extra", {})}
+        return msg, kwargs
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that merges the message arguments before enqueueing but keeps exc_info, so the
+    traceback is formatted by the listener's formatter instead of being folded into the message.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def _configure_logging():
+    if not LOG_JSON:
+        logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonLogFormatter())
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    # 入队前只合并消息参数，JSON格式化（包括异常堆栈）在后台线程中完成
+    queue_handler = _DeferredQueueHandler(log_queue)
+    logging.basicConfig(level=LOG_LEVEL, handlers=[queue_handler])
+
+# 直接运行本脚本时，spawn出的解析进程会以__mp_main__重新执行整个模块；此时跳过日志配置和存储恢复
+_IN_PARSE_WORKER = __name__ == "__mp_main__"
+
 # 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+if not _IN_PARSE_WORKER:
+    _configure_logging()
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="DaPlot API")
+# 上传文件落盘的目录和分块大小
+UPLOAD_SPOOL_DIR = os.environ.get("DAPLOT_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "daplot_uploads"))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 支持上传的文件类型
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+TABULAR_EXTENSIONS = ('.csv', '.parquet', '.feather', '.arrow')
+
+# 预览上传模式读取的行数，以及数据接口等待后台加载完成的最长秒数
+PREVIEW_ROWS = int(os.environ.get("DAPLOT_PREVIEW_ROWS", 5))
+LOAD_WAIT_SECONDS = float(os.environ.get("DAPLOT_LOAD_WAIT_SECONDS", 0))
+
+# 入库时压缩列类型：唯一值占比不超过该比例的字符串列转换为category
+OPTIMIZE_DTYPES = os.environ.get("DAPLOT_OPTIMIZE_DTYPES", "1") != "0"
+CATEGORY_MAX_RATIO = float(os.environ.get("DAPLOT_CATEGORY_MAX_RATIO", 0.5))
+
+# 列统计目录：保存的高频值数量，以及唯一值不超过该数量时缓存完整唯一值列表
+CATALOG_TOP_VALUES = 5
+CATALOG_MAX_UNIQUE = int(os.environ.get("DAPLOT_CATALOG_MAX_UNIQUE", 1000))
+
+# 数据存储的内存预算（MB，0表示不限制），超出时最久未使用的数据溢出到该目录
+MEMORY_BUDGET_BYTES = int(float(os.environ.get("DAPLOT_MEMORY_BUDGET_MB", 2048)) * 1024 * 1024)
+SPILL_DIR = os.environ.get("DAPLOT_SPILL_DIR", os.path.join(tempfile.gettempdir(), "daplot_spill"))
+
+# 持久化存储目录：设置后数据以Arrow IPC文件写入该目录，服务重启后按需内存映射重新打开
+STORAGE_DIR = os.environ.get("DAPLOT_STORAGE_DIR")
+
+# 保存时保留的历史版本：每个文件最多保留的版本数，以及所有历史版本独占内存的总预算（MB）
+MAX_RETAINED_VERSIONS = int(os.environ.get("DAPLOT_MAX_RETAINED_VERSIONS", 5))
+VERSION_BUDGET_BYTES = int(float(os.environ.get("DAPLOT_VERSION_BUDGET_MB", 256)) * 1024 * 1024)
+
+# 唯一值不超过该数量的列按值建立位图索引，多列筛选在压缩位图上做与/或运算
+BITMAP_MAX_VALUES = int(os.environ.get("DAPLOT_BITMAP_MAX_VALUES", 64))
+
+# 筛选结果缓存的内存上限（MB），缓存匹配行的位置而不是数据副本
+FILTER_CACHE_BYTES = int(float(os.environ.get("DAPLOT_FILTER_CACHE_MB", 64)) * 1024 * 1024)
+
+# 分页返回数据时每页的最大行数
+MAX_PAGE_ROWS = int(os.environ.get("DAPLOT_MAX_PAGE_ROWS", 10000))
+
+# NDJSON流式响应每批序列化的行数
+STREAM_BATCH_ROWS = int(os.environ.get("DAPLOT_STREAM_BATCH_ROWS", 1000))
+
+# 列式JSON和二进制响应的媒体类型，通过Accept请求头或format查询参数协商
+COLUMNAR_MEDIA_TYPE = "application/vnd.daplot.columnar+json"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+# 各列依次拼接的小端Float64缓冲区，空值为NaN
+FLOAT64_MEDIA_TYPE = "application/vnd.daplot.float64"
+# 每行一个JSON对象，逐批生成
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+RESPONSE_FORMATS = {COLUMNAR_MEDIA_TYPE: "columnar", ARROW_STREAM_MEDIA_TYPE: "arrow", FLOAT64_MEDIA_TYPE: "float64",
+                    NDJSON_MEDIA_TYPE: "ndjson"}
+
+# 内存配额（MB，0表示不限制）：单个文件的数据大小上限，以及所有数据和历史版本的总量上限
+FILE_QUOTA_BYTES = int(float(os.environ.get("DAPLOT_FILE_QUOTA_MB", 0)) * 1024 * 1024)
+GLOBAL_QUOTA_BYTES = int(float(os.environ.get("DAPLOT_GLOBAL_QUOTA_MB", 0)) * 1024 * 1024)
+
+# 数据过期策略（秒，0表示不过期）：闲置超过IDLE_TTL或上传后超过ABSOLUTE_TTL的数据由后台任务定期清理
+IDLE_TTL_SECONDS = float(os.environ.get("DAPLOT_IDLE_TTL_SECONDS", 0))
+ABSOLUTE_TTL_SECONDS = float(os.environ.get("DAPLOT_ABSOLUTE_TTL_SECONDS", 0))
+SWEEP_INTERVAL_SECONDS = float(os.environ.get("DAPLOT_SWEEP_INTERVAL_SECONDS", 60))
+# 已完成或失败的上传任务保留的秒数，到期后由同一后台任务清理（0表示在下一次清理时移除）
+JOB_TTL_SECONDS = float(os.environ.get("DAPLOT_JOB_TTL_SECONDS", 3600))
+
+# 多worker共享存储：各进程通过存储目录中的索引共享数据和上传任务，未设置存储目录时使用临时目录
+SHARED_STORE = os.environ.get("DAPLOT_SHARED_STORE", "0") == "1"
+if SHARED_STORE and not STORAGE_DIR:
+    STORAGE_DIR = os.path.join(tempfile.gettempdir(), "daplot_store")
+
+# 并行解析工作表的进程数，设为1时在当前进程中逐个解析
+PARSE_WORKERS = int(os.environ.get("DAPLOT_PARSE_WORKERS", min(4, os.cpu_count() or 1)))
+
+_parse_pool = None
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    """
+    Returns the shared sheet-parsing process pool, creating it on first use.
+    """
+    global _parse_pool
+    if _parse_pool is None:
+        # spawn avoids forking a process that already runs server threads
+        _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        logger.info(f"⚙️ 已创建工作表解析进程池，进程数: {PARSE_WORKERS}")
+    return _parse_pool
+
+async def _sweep_periodically():
+    """
+    Background task: removes expired datasets every SWEEP_INTERVAL_SECONDS.
+    """
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+        try:
+            _sweep_expired_files()
+        except Exception as e:
+            logger.error(f"❌ 过期数据清理失败: {str(e)}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sweeper = asyncio.create_task(_sweep_periodically()) if SWEEP_INTERVAL_SECONDS > 0 else None
+    yield
+    if sweeper is not None:
+        sweeper.cancel()
+    if _parse_pool is not None:
+        _parse_pool.shutdown(cancel_futures=True)
+
+app = FastAPI(title="DaPlot API", lifespan=lifespan)
 
 # Add CORS middleware to allow cross-origin requests
 app.add_middleware(
@@ -31,19 +240,818 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["ETag", "X-Columns", "X-Row-Count", "X-Total-Count", "X-Next-Cursor", "X-Plot-Labels"],
 )
 
-# A simple in-memory storage for uploaded dataframes and file metadata
-data_storage = {}
+def _process_running(pid: int) -> bool:
+    """
+    Returns whether a process with the given ID is running. Always True on Windows, where
+    probing with os.kill would terminate it.
+    """
+    if os.name == "nt" or pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class DatasetStore:
+    """
+    Dict-like storage of DataFrames by file ID, bounded by a memory budget.
+    Frames are accounted with memory_usage(deep=True); when the budget is exceeded the
+    least recently used frames are spilled to uncompressed Arrow IPC (or pickle) files in
+    spill_dir and reloaded transparently, memory-mapped, on the next access. Several file
+    IDs may share one frame.
+
+    A persistent store writes every frame through to spill_dir when it is stored and keeps
+    a SQLite index of file IDs, frame files and file metadata, so restore() can reopen the
+    datasets after a restart without reading them. Processes sharing the directory see each
+    other's datasets through refresh() and refresh_all(). A non-persistent store spills into
+    its own per-process subdirectory, removed at exit or on the next start after a crash.
+    """
+
+    def __init__(self, memory_budget: int, spill_dir: str, persistent: bool = False):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.persistent = persistent
+        self.resident_bytes = 0
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "spilled_bytes": 0}
+        self._lock = threading.RLock()
+        self._keys = {}  # file_id -> frame ID
+        self._frames = OrderedDict()  # frame ID -> 记录，按最近使用顺序排列
+        self._resident_ids = {}  # id(DataFrame) -> frame ID，识别共享同一对象的file_id
+        self._path_ids = {}  # 数据文件路径 -> frame ID，识别其他进程写入的同一数据
+        self._index_metadata = {}  # file_id -> 最近一次从索引读到或写入的元数据JSON
+        self._next_frame_id = 0
+        self._index = None
+
+        if persistent:
+            os.makedirs(spill_dir, exist_ok=True)
+            # 多个worker进程共用同一索引，WAL模式允许读写并发
+            self._index = sqlite3.connect(os.path.join(spill_dir, "index.sqlite"), timeout=30, check_same_thread=False)
+            self._index.execute("PRAGMA journal_mode=WAL")
+            self._index.execute(
+                "CREATE TABLE IF NOT EXISTS datasets (file_id TEXT PRIMARY KEY, frame_path TEXT, metadata TEXT)"
+            )
+            self._index.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, data TEXT)")
+            # 各进程最近一次读取或保存数据的时间，闲置过期按所有进程中最近的访问判断
+            self._index.execute("CREATE TABLE IF NOT EXISTS access (file_id TEXT PRIMARY KEY, last_access REAL)")
+            self._index.commit()
+        else:
+            # 溢出文件只在本进程内有效：写入按进程ID命名的子目录，退出时删除；异常退出的进程留下的子目录启动时清理
+            self.spill_dir = os.path.join(spill_dir, f"proc-{os.getpid()}")
+            self._remove_stale_spill_dirs(spill_dir)
+            atexit.register(self._remove_spill_dir)
+
+    def __contains__(self, key) -> bool:
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(list(self._keys))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __getitem__(self, key) -> pd.DataFrame:
+        df = self.get(key)
+        if df is None:
+            raise KeyError(key)
+        return df
+
+    def __setitem__(self, key, df: pd.DataFrame):
+        self.put(key, df)
+
+    def put(self, key, df: pd.DataFrame, metadata: Optional[Dict[str, Any]] = None):
+        """
+        Stores a frame under a key, replacing any previous one. With a persistent index the frame
+        path and metadata are written in one upsert, so other processes never see a replaced key
+        as removed or without metadata; when metadata is None the indexed metadata is kept.
+        """
+        with self._lock:
+            previous_frame_id = self._keys.get(key)
+
+            frame_id = self._resident_ids.get(id(df))
+            if frame_id is None:
+                frame_id = self._new_frame(df, int(df.memory_usage(deep=True).sum()), None)
+                self._resident_ids[id(df)] = frame_id
+                self.resident_bytes += self._frames[frame_id]["bytes"]
+
+            frame = self._frames[frame_id]
+            if self.persistent and frame["path"] is None:
+                self._write_frame(frame_id, frame)
+
+            frame["keys"].add(key)
+            self._keys[key] = frame_id
+            self._frames.move_to_end(frame_id)
+            if self._index is not None:
+                metadata_json = json.dumps(metadata, default=str) if metadata is not None else None
+                self._index.execute(
+                    "INSERT INTO datasets (file_id, frame_path, metadata) VALUES (?, ?, ?) "
+                    "ON CONFLICT(file_id) DO UPDATE SET frame_path = excluded.frame_path, "
+                    "metadata = COALESCE(excluded.metadata, datasets.metadata)",
+                    (key, frame["path"], metadata_json)
+                )
+                self._index.commit()
+                if metadata_json is not None:
+                    self._index_metadata[key] = metadata_json
+                else:
+                    self._index_metadata.setdefault(key, None)
+            # 索引已指向新数据后再释放旧数据，其他进程不会看到该key被删除
+            if previous_frame_id is not None and previous_frame_id != frame_id:
+                self._release_frame_ref(previous_frame_id, key)
+            self._enforce_budget(frame_id)
+
+    def get(self, key, default=None) -> Optional[pd.DataFrame]:
+        """
+        Returns the frame for a key, reloading it from its spill file if it was evicted.
+        """
+        with self._lock:
+            frame_id = self._keys.get(key)
+            if frame_id is None:
+                return default
+
+            frame = self._frames[frame_id]
+            if frame["df"] is None:
+                self.counters["misses"] += 1
+                self._reload(frame_id, frame)
+            else:
+                self.counters["hits"] += 1
+
+            self._frames.move_to_end(frame_id)
+            df = frame["df"]
+            self._enforce_budget(frame_id)
+            return df
+
+    def peek(self, key) -> Optional[pd.DataFrame]:
+        """
+        Returns the frame for a key only if it is resident, without reloading or touching LRU order.
+        """
+        frame_id = self._keys.get(key)
+        return self._frames[frame_id]["df"] if frame_id is not None else None
+
+    def pop(self, key, default=None):
+        """
+        Removes a key. Returns its frame if resident, None if spilled, or default if missing.
+        """
+        with self._lock:
+            if key not in self._keys:
+                return default
+            df = self.peek(key)
+            self._discard(key)
+            return df
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._keys):
+                self._discard(key)
+            if not self.persistent:
+                self._remove_spill_dir()
+
+            if self._index is not None:
+                # 同时清除其他进程登记的数据
+                for key, path in self._index.execute("SELECT file_id, frame_path FROM datasets").fetchall():
+                    if path is not None and os.path.exists(path):
+                        os.remove(path)
+                self._index.execute("DELETE FROM datasets")
+                self._index.execute("DELETE FROM access")
+                self._index.commit()
+
+    def save_metadata(self, key, metadata: Optional[Dict[str, Any]]):
+        """
+        Records a file's metadata in the persistent index. No-op for a non-persistent store.
+        """
+        if self._index is None or key not in self._keys:
+            return
+        with self._lock:
+            metadata_json = json.dumps(metadata or {}, default=str)
+            self._index.execute("UPDATE datasets SET metadata = ? WHERE file_id = ?", (metadata_json, key))
+            self._index.commit()
+            self._index_metadata[key] = metadata_json
+
+    def restore(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Registers the datasets of the persistent index as spilled frames, to be memory-mapped
+        on first access, and returns their metadata by file ID.
+        """
+        restored = {}
+        if self._index is None:
+            return restored
+
+        with self._lock:
+            rows = self._index.execute("SELECT file_id, frame_path, metadata FROM datasets").fetchall()
+            for key, path, metadata_json in rows:
+                if path is None or not os.path.exists(path):
+                    logger.warning(f"⚠️ 持久化数据文件缺失，跳过: {key}")
+                    self._index.execute("DELETE FROM datasets WHERE file_id = ?", (key,))
+                    continue
+                restored[key] = self._register_indexed(key, path, metadata_json)
+
+            self._index.commit()
+
+        return restored
+
+    def refresh(self, key) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        Reconciles one key with the shared index after other processes may have changed it.
+        Returns ("unchanged" | "missing" | "removed" | "updated", metadata of an updated key).
+        """
+        if self._index is None:
+            return "unchanged", None
+
+        with self._lock:
+            row = self._index.execute("SELECT frame_path, metadata FROM datasets WHERE file_id = ?", (key,)).fetchone()
+            return self._reconcile(key, row)
+
+    def refresh_all(self) -> Dict[str, Tuple[str, Optional[Dict[str, Any]]]]:
+        """
+        Reconciles every key with the shared index, returning the keys that changed and how.
+        """
+        changes = {}
+        if self._index is None:
+            return changes
+
+        with self._lock:
+            rows = {key: (path, metadata_json) for key, path, metadata_json
+                    in self._index.execute("SELECT file_id, frame_path, metadata FROM datasets").fetchall()}
+            for key in set(self._keys) | set(rows):
+                state, metadata = self._reconcile(key, rows.get(key))
+                if state in ("removed", "updated"):
+                    changes[key] = (state, metadata)
+
+        return changes
+
+    def save_job(self, job: Dict[str, Any]):
+        """
+        Publishes an upload job's progress to the shared index. No-op for a non-persistent store.
+        """
+        if self._index is None:
+            return
+        with self._lock:
+            self._index.execute(
+                "INSERT INTO jobs (job_id, data) VALUES (?, ?) ON CONFLICT(job_id) DO UPDATE SET data = excluded.data",
+                (job["job_id"], json.dumps(job, default=str))
+            )
+            self._index.commit()
+
+    def load_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns an upload job published by any process sharing the index.
+        """
+        if self._index is None:
+            return None
+        with self._lock:
+            row = self._index.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def remove_jobs(self, finished_before: Optional[str] = None) -> int:
+        """
+        Removes finished upload jobs from the shared index, either those finished before an ISO
+        timestamp or all of them. Returns the number removed; no-op for a non-persistent store.
+        """
+        if self._index is None:
+            return 0
+        query = "DELETE FROM jobs WHERE json_extract(data, '$.finished_time') IS NOT NULL"
+        params = ()
+        if finished_before is not None:
+            query += " AND json_extract(data, '$.finished_time') < ?"
+            params = (finished_before,)
+        with self._lock:
+            removed = self._index.execute(query, params).rowcount
+            self._index.commit()
+        return removed
+
+    def record_access(self, key, when: float):
+        """
+        Records that a key was used at `when` in the shared index. No-op for a non-persistent store.
+        """
+        if self._index is None:
+            return
+        with self._lock:
+            self._index.execute(
+                "INSERT INTO access (file_id, last_access) VALUES (?, ?) "
+                "ON CONFLICT(file_id) DO UPDATE SET last_access = MAX(last_access, excluded.last_access)",
+                (key, when)
+            )
+            self._index.commit()
+
+    def last_access_times(self) -> Dict[str, float]:
+        """
+        Returns the last use of every key recorded by any process sharing the index.
+        """
+        if self._index is None:
+            return {}
+        with self._lock:
+            return dict(self._index.execute("SELECT file_id, last_access FROM access").fetchall())
+
+    def total_bytes(self) -> int:
+        """
+        Returns the deep memory size of all stored frames, resident or spilled, counting shared frames once.
+        """
+        with self._lock:
+            return sum(frame["bytes"] for frame in self._frames.values())
+
+    def frame_info(self, key) -> Optional[Dict[str, Any]]:
+        """
+        Returns the size of a key's frame, whether it is resident, and the keys sharing it.
+        """
+        with self._lock:
+            frame_id = self._keys.get(key)
+            if frame_id is None:
+                return None
+            frame = self._frames[frame_id]
+            return {"bytes": frame["bytes"], "resident": frame["df"] is not None, "keys": sorted(frame["keys"])}
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the store's size and its hit/miss/eviction counters.
+        """
+        with self._lock:
+            resident = sum(1 for frame in self._frames.values() if frame["df"] is not None)
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                "datasets": len(self._keys),
+                "frames": len(self._frames),
+                "resident_frames": resident,
+                "spilled_frames": len(self._frames) - resident,
+                "resident_bytes": self.resident_bytes,
+                "total_bytes": self.total_bytes(),
+                "memory_budget": self.memory_budget,
+                "hit_rate": self.counters["hits"] / lookups if lookups else None,
+                **self.counters
+            }
+
+    def _new_frame(self, df: Optional[pd.DataFrame], size: int, path: Optional[str]) -> int:
+        frame_id = self._next_frame_id
+        self._next_frame_id += 1
+        self._frames[frame_id] = {"df": df, "bytes": size, "path": path, "keys": set()}
+        if path is not None:
+            self._path_ids[path] = frame_id
+        return frame_id
+
+    def _register_indexed(self, key, path: str, metadata_json: Optional[str]) -> Dict[str, Any]:
+        metadata = json.loads(metadata_json) if metadata_json else {}
+        frame_id = self._path_ids.get(path)
+        if frame_id is None:
+            frame_id = self._new_frame(None, metadata.get("memory_bytes", 0), path)
+            self._frames.move_to_end(frame_id, last=False)
+
+        self._frames[frame_id]["keys"].add(key)
+        self._keys[key] = frame_id
+        self._index_metadata[key] = metadata_json
+        return metadata
+
+    def _reconcile(self, key, row: Optional[Tuple[str, Optional[str]]]) -> Tuple[str, Optional[Dict[str, Any]]]:
+        frame_id = self._keys.get(key)
+        if row is None:
+            if frame_id is None:
+                return "missing", None
+            # 已被其他进程删除
+            self._discard(key, update_index=False)
+            return "removed", None
+
+        path, metadata_json = row
+        if frame_id is not None and self._frames[frame_id]["path"] == path and self._index_metadata.get(key) == metadata_json:
+            return "unchanged", None
+
+        # 由其他进程新建或覆盖保存
+        if frame_id is not None:
+            self._discard(key, update_index=False)
+        if path is None or not os.path.exists(path):
+            return "removed", None
+        return "updated", self._register_indexed(key, path, metadata_json)
+
+    def _discard(self, key, update_index: bool = True):
+        frame_id = self._keys.pop(key, None)
+        self._index_metadata.pop(key, None)
+        if frame_id is None:
+            return
+
+        if self._index is not None and update_index:
+            self._index.execute("DELETE FROM datasets WHERE file_id = ?", (key,))
+            self._index.execute("DELETE FROM access WHERE file_id = ?", (key,))
+            self._index.commit()
+        self._release_frame_ref(frame_id, key)
+
+    def _release_frame_ref(self, frame_id: int, key):
+        frame = self._frames[frame_id]
+        frame["keys"].discard(key)
+        if frame["keys"]:
+            return
+
+        # 最后一个引用被删除，释放内存和数据文件
+        del self._frames[frame_id]
+        if frame["df"] is not None:
+            del self._resident_ids[id(frame["df"])]
+            self.resident_bytes -= frame["bytes"]
+        if frame["path"] is not None:
+            self._path_ids.pop(frame["path"], None)
+            if self._index is not None:
+                # 其他进程的file_id仍可能引用该文件
+                in_use = self._index.execute("SELECT 1 FROM datasets WHERE frame_path = ? LIMIT 1", (frame["path"],)).fetchone()
+                if in_use:
+                    return
+            if os.path.exists(frame["path"]):
+                os.remove(frame["path"])
+
+    def _enforce_budget(self, keep_frame_id: int):
+        if not self.memory_budget:
+            return
+
+        for frame_id in list(self._frames):
+            if self.resident_bytes <= self.memory_budget:
+                break
+            frame = self._frames[frame_id]
+            if frame_id == keep_frame_id or frame["df"] is None:
+                continue
+            self._spill(frame_id, frame)
+
+    def _remove_spill_dir(self):
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    @staticmethod
+    def _remove_stale_spill_dirs(root: str):
+        if not os.path.isdir(root):
+            return
+        for name in os.listdir(root):
+            pid = name[len("proc-"):]
+            if name.startswith("proc-") and pid.isdigit() and not _process_running(int(pid)):
+                logger.info(f"🧹 清理已退出进程留下的溢出目录: {name}")
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+    def _write_frame(self, frame_id: int, frame: Dict[str, Any]):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"{uuid.uuid4().hex}.arrow")
+        try:
+            # 不压缩，重新加载时可以内存映射而不复制数值列
+            frame["df"].to_feather(path, compression="uncompressed")
+        except Exception:
+            # 缺少pyarrow或列名/索引不受Arrow支持时退回pickle
+            if os.path.exists(path):
+                os.remove(path)
+            path = path[:-len(".arrow")] + ".pkl"
+            frame["df"].to_pickle(path)
+        frame["path"] = path
+        self._path_ids[path] = frame_id
+        self.counters["spilled_bytes"] += os.path.getsize(path)
+
+    def _spill(self, frame_id: int, frame: Dict[str, Any]):
+        df = frame["df"]
+        # 数据不可变，已有溢出文件时无需重写
+        if frame["path"] is None:
+            self._write_frame(frame_id, frame)
+
+        del self._resident_ids[id(df)]
+        frame["df"] = None
+        self.resident_bytes -= frame["bytes"]
+        self.counters["evictions"] += 1
+        logger.info(f"💽 内存超出预算，数据已溢出到磁盘: {sorted(frame['keys'])} ({frame['bytes']} bytes)")
+
+    def _reload(self, frame_id: int, frame: Dict[str, Any]):
+        path = frame["path"]
+        if path.endswith(".pkl"):
+            df = pd.read_pickle(path)
+        else:
+            import pyarrow.feather as feather
+            # 内存映射读取，无空值的数值列直接引用映射的缓冲区
+            df = feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+        frame["df"] = df
+        if not frame["bytes"]:
+            frame["bytes"] = int(df.memory_usage(deep=True).sum())
+        self._resident_ids[id(df)] = frame_id
+        self.resident_bytes += frame["bytes"]
+        logger.info(f"💽 从磁盘重新加载数据: {sorted(frame['keys'])}")
+
+class ColumnIndex:
+    """
+    Lookup structures for filtering one column, built once per dataset version.
+    Each key kind factorizes the column into per-row codes and unique keys:
+    "direct" uses the values as stored, "string" their str() form and "numeric" the values
+    converted with pd.to_numeric. A filter evaluates isin() on the unique keys only and then
+    gathers the matching row positions, so it matches exactly the rows the same isin() on the
+    whole column would.
+    """
+
+    # 匹配行数低于总行数的该比例时按分组位置收集，否则扫描行代码
+    GATHER_RATIO = 0.125
+
+    def __init__(self, numeric: bool):
+        self.numeric = numeric
+        self._parts = {}  # 键类型 -> {"codes", "uniques", "counts", "order", "offsets", "bitmaps"}
+
+    def uses_bitmaps(self, kind: str, column: pd.Series) -> bool:
+        """
+        Returns whether the column has few enough distinct `kind` keys for per-key bitmaps.
+        """
+        return len(self._part(kind, column)["uniques"]) <= BITMAP_MAX_VALUES
+
+    def match_bitmap(self, kind: str, column: pd.Series, values: List[Any], candidates: Optional[np.ndarray]) -> np.ndarray:
+        """
+        Returns a packed bitmap of the rows whose `kind` key is in values: the OR of the
+        matching keys' bitmaps, ANDed with the candidate bitmap if given.
+        """
+        part = self._part(kind, column)
+        matched = pd.Series(part["uniques"]).isin(values).to_numpy()
+
+        bitmap = np.zeros((len(part["codes"]) + 7) // 8, dtype=np.uint8)
+        for key in np.flatnonzero(matched):
+            bitmap |= self._key_bitmap(part, key)
+        if candidates is not None:
+            bitmap &= candidates
+        return bitmap
+
+    def match(self, kind: str, column: pd.Series, values: List[Any], candidates: Optional[np.ndarray]) -> np.ndarray:
+        """
+        Returns the ascending positions of the rows whose `kind` key is in values,
+        restricted to the candidate positions if given.
+        """
+        return self.match_keys(kind, column, lambda keys: keys.isin(values), candidates)
+
+    def match_keys(self, kind: str, column: pd.Series, predicate, candidates: Optional[np.ndarray]) -> np.ndarray:
+        """
+        Like match(), for the rows whose `kind` key satisfies predicate, a vectorized function
+        from a Series of unique keys to a boolean Series.
+        """
+        part = self._part(kind, column)
+        matched = predicate(pd.Series(part["uniques"])).fillna(False).to_numpy(dtype=bool)
+
+        if candidates is not None:
+            return candidates[matched[part["codes"][candidates]]]
+
+        keys = np.flatnonzero(matched)
+        total = int(part["counts"][keys].sum())
+        if total == 0:
+            return np.empty(0, dtype=np.intp)
+        if total > len(part["codes"]) * self.GATHER_RATIO:
+            return np.flatnonzero(matched[part["codes"]])
+
+        order, offsets = self._grouped_positions(part)
+        positions = np.concatenate([order[offsets[key]:offsets[key + 1]] for key in keys])
+        return np.sort(positions).astype(np.intp)
+
+    def nbytes(self) -> int:
+        return sum(
+            (array.nbytes for part in self._parts.values()
+             for name, array in part.items() if name in ("codes", "counts", "order", "offsets") and array is not None),
+            sum(bitmap.nbytes for part in self._parts.values() for bitmap in part["bitmaps"].values())
+        )
+
+    def _part(self, kind: str, column: pd.Series) -> Dict[str, Any]:
+        part = self._parts.get(kind)
+        if part is not None:
+            return part
+
+        values = column
+        if kind == "string":
+            values = column.astype(str)
+        elif kind == "numeric" and not self.numeric:
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype(object)
+            values = pd.to_numeric(values, errors='coerce')
+
+        # NaN也作为一个键，与isin()把NaN视为相等的语义一致
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        part = {
+            "codes": codes.astype(np.int32),
+            "uniques": uniques,
+            "counts": np.bincount(codes, minlength=len(uniques)),
+            "order": None,
+            "offsets": None,
+            "bitmaps": {}
+        }
+        self._parts[kind] = part
+        return part
+
+    def _grouped_positions(self, part: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+        if part["order"] is None:
+            # 按键分组的行位置，组内保持行顺序
+            part["order"] = np.argsort(part["codes"], kind="stable").astype(np.int32)
+            part["offsets"] = np.concatenate(([0], np.cumsum(part["counts"])))
+        return part["order"], part["offsets"]
+
+    def _key_bitmap(self, part: Dict[str, Any], key: int) -> np.ndarray:
+        bitmap = part["bitmaps"].get(key)
+        if bitmap is None:
+            # 每行一位，按需为被筛选过的键建立
+            bitmap = np.packbits(part["codes"] == key)
+            part["bitmaps"][key] = bitmap
+        return bitmap
+
+def _popcount(bitmap: np.ndarray) -> int:
+    if hasattr(np, "bitwise_count"):
+        return int(np.bitwise_count(bitmap).sum(dtype=np.int64))
+    return int(np.unpackbits(bitmap).sum(dtype=np.int64))
+
+def _match_rows(index: ColumnIndex, kind: str, column: pd.Series, values: List[Any],
+                candidates: Optional[np.ndarray]) -> np.ndarray:
+    """
+    Narrows the candidate rows to those whose `kind` key is in values. Candidates are None (all
+    rows), a packed bitmap (uint8) or ascending positions; the result is a bitmap while every
+    column so far had bitmaps, and positions otherwise.
+    """
+    is_bitmap = candidates is not None and candidates.dtype == np.uint8
+    if (candidates is None or is_bitmap) and index.uses_bitmaps(kind, column):
+        return index.match_bitmap(kind, column, values, candidates)
+    if is_bitmap:
+        candidates = _candidate_positions(candidates, len(column))
+    return index.match(kind, column, values, candidates)
+
+def _candidate_count(candidates: np.ndarray) -> int:
+    return _popcount(candidates) if candidates.dtype == np.uint8 else len(candidates)
+
+def _candidate_positions(candidates: np.ndarray, rows: int) -> np.ndarray:
+    if candidates.dtype == np.uint8:
+        return np.flatnonzero(np.unpackbits(candidates, count=rows))
+    return candidates
+
+class FilterResultCache:
+    """
+    LRU cache of filter results as arrays of row positions, bounded by their total size in bytes.
+    Keys start with (file_id, version) so a save makes earlier entries unreachable;
+    invalidate() drops them eagerly.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> 行位置数组，按最近使用顺序排列
+
+    def get(self, key: Tuple) -> Optional[np.ndarray]:
+        with self._lock:
+            rows = self._entries.get(key)
+            if rows is None:
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return rows
+
+    def put(self, key: Tuple, rows: np.ndarray):
+        if rows.nbytes > self.max_bytes:
+            return
+        # 行数不超过int32范围时以int32存储，减半内存
+        if len(rows) and rows[-1] < np.iinfo(np.int32).max:
+            rows = rows.astype(np.int32)
+        rows.flags.writeable = False
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous.nbytes
+            self._entries[key] = rows
+            self.bytes += rows.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.counters["evictions"] += 1
+
+    def invalidate(self, file_id: Optional[str] = None):
+        """
+        Drops the entries of a file, or every entry when file_id is None.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if file_id is None or key[0] == file_id:
+                    self.bytes -= self._entries.pop(key).nbytes
+
+    def file_bytes(self, file_id: str) -> int:
+        with self._lock:
+            return sum(rows.nbytes for key, rows in self._entries.items() if key[0] == file_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hit_rate": self.counters["hits"] / lookups if lookups else None,
+                **self.counters
+            }
+
+# A memory-bounded storage for uploaded dataframes, and file metadata
+data_storage = DatasetStore(MEMORY_BUDGET_BYTES, STORAGE_DIR or SPILL_DIR, persistent=bool(STORAGE_DIR) and not _IN_PARSE_WORKER)
 file_metadata = {}  # 存储文件元数据，包括原始文件名和sheet信息
+upload_jobs = {}  # 后台上传任务的状态和进度，按job_id索引
+lazy_sources = {}  # 延迟解析的工作簿落盘路径 -> 尚未解析的file_id集合
+_materialize_locks = {}  # 每个file_id一把锁，避免同一sheet被并发重复解析
+upload_index = {}  # 上传内容哈希 -> [(sheet_name, sheet_hash)]，重复上传时跳过解析
+shared_frames = {}  # sheet内容哈希 -> 共享该DataFrame的file_id集合（引用计数）
+column_catalog = {}  # file_id -> 每列的统计信息，入库和保存时计算
+filter_indexes = {}  # file_id -> {"version", "columns": {列名: ColumnIndex}}，筛选时按需构建
+filter_cache = FilterResultCache(FILTER_CACHE_BYTES)  # (file_id, version, 匹配方式, 筛选条件, 投影) -> 行位置
+last_access = {}  # file_id -> 最近一次被读取或保存的时间（time.time()）
+_published_access = {}  # file_id -> 最近一次写入共享索引的访问时间
+expiry_stats = {"sweeps": 0, "expired_files": 0, "expired_jobs": 0, "reclaimed_bytes": 0, "last_sweep_time": None}
+dataset_versions = OrderedDict()  # (file_id, version) -> 被保存替换的历史版本 {"df", "bytes"}，按替换顺序排列
+
+# 共享存储中同一文件的访问时间最多每隔这么多秒写一次索引
+ACCESS_PUBLISH_SECONDS = 5
+
+def _record_access(file_id: str, now: Optional[float] = None):
+    """
+    Restarts a file's idle clock. With a shared store the access is also published to the
+    index, at most every ACCESS_PUBLISH_SECONDS, so every worker's sweep sees it.
+    """
+    now = time.time() if now is None else now
+    last_access[file_id] = now
+    if SHARED_STORE and now - _published_access.get(file_id, 0) >= ACCESS_PUBLISH_SECONDS:
+        _published_access[file_id] = now
+        data_storage.record_access(file_id, now)
+
+def _restore_persisted_files():
+    """
+    Reopens the datasets of a persistent store after a restart. Frames stay on disk until first accessed.
+    """
+    restored = data_storage.restore()
+    for file_id, metadata in restored.items():
+        file_metadata[file_id] = metadata
+        last_access[file_id] = time.time()
+        if metadata.get("sheet_hash"):
+            shared_frames.setdefault(metadata["sheet_hash"], set()).add(file_id)
+
+    if restored:
+        logger.info(f"💾 已从持久化存储恢复 {len(restored)} 个文件: {STORAGE_DIR}")
+
+if not _IN_PARSE_WORKER:
+    _restore_persisted_files()
+
+def _apply_shared_change(file_id: str, state: str, metadata: Optional[Dict[str, Any]]):
+    """
+    Applies a change another worker made to a file ID to this process's metadata and catalogs.
+    """
+    _release_frame(file_id, file_metadata.pop(file_id, None))
+    column_catalog.pop(file_id, None)
+    filter_indexes.pop(file_id, None)
+    filter_cache.invalidate(file_id)
+    if state == "removed":
+        _drop_versions(file_id)
+        last_access.pop(file_id, None)
+        _published_access.pop(file_id, None)
+    if state == "updated":
+        file_metadata[file_id] = metadata
+        if metadata.get("sheet_hash"):
+            shared_frames.setdefault(metadata["sheet_hash"], set()).add(file_id)
+
+def _sync_shared_file(file_id: str):
+    """
+    Picks up another worker's upload, save or delete of a file ID. No-op unless SHARED_STORE is set.
+    """
+    if not SHARED_STORE:
+        return
+    state, metadata = data_storage.refresh(file_id)
+    if state in ("removed", "updated"):
+        logger.info(f"🔄 同步其他进程的数据变更: {file_id} ({state})")
+        _apply_shared_change(file_id, state, metadata)
+
+def _sync_shared_files():
+    """
+    Picks up every file other workers added, saved or deleted. No-op unless SHARED_STORE is set.
+    """
+    if not SHARED_STORE:
+        return
+    changes = data_storage.refresh_all()
+    for file_id, (state, metadata) in changes.items():
+        _apply_shared_change(file_id, state, metadata)
+    if changes:
+        logger.info(f"🔄 已同步其他进程的 {len(changes)} 个数据变更")
+
+def _publish_job(job: Dict[str, Any]):
+    """
+    Makes an upload job's progress visible to the other workers. No-op unless SHARED_STORE is set.
+    """
+    if SHARED_STORE:
+        data_storage.save_job(job)
+
+class FilterExpression(BaseModel):
+    """
+    A node of a filter expression tree: {"op": "and" | "or" | "not", "args": [...]} or a
+    comparison {"column": ..., "op": ..., "value": ...} with op one of ==, !=, >, >=, <, <=,
+    between ([low, high]), in, not in (lists), is null, is not null or contains. Null rows never
+    satisfy a comparison, and null operands are rejected in favour of is null / is not null.
+    """
+    op: str
+    column: Optional[str] = None
+    value: Any = None
+    args: List["FilterExpression"] = []
 
 class FilterPayload(BaseModel):
     file_id: str
     filters: Dict[str, List[str]]
+    where: Optional[FilterExpression] = None
+    offset: Optional[int] = None
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+    columns: Optional[List[str]] = None
 
 class PlotDataPayload(BaseModel):
     file_id: str
     filters: Dict[str, List[str]]
+    where: Optional[FilterExpression] = None
     x_axis: str
     y_axis: str
 
@@ -87,233 +1095,1891 @@ class DirectPredictionPayload(BaseModel):
 def read_root():
     return {"message": "Welcome to DaPlot API"}
 
-@app.post("/api/upload")
-async def upload_excel_file(file: UploadFile = File(...)):
+def _get_dataframe(file_id: str) -> pd.DataFrame:
     """
-    Handles the upload of an Excel file, processes it, and returns a preview.
-    Supports multiple sheets and returns information about all sheets.
+    Returns the stored DataFrame for a file ID, parsing a lazily registered sheet on first access.
+    Raises 503 if the sheet is being loaded in the background and does not finish within LOAD_WAIT_SECONDS.
     """
-    logger.info(f"📁 收到文件上传请求: {file.filename}")
-    logger.info(f"📊 文件大小: {file.size if hasattr(file, 'size') else '未知'} bytes")
-    logger.info(f"📋 文件类型: {file.content_type}")
+    _sync_shared_file(file_id)
+    df = data_storage.get(file_id)
+    if df is not None:
+        _record_access(file_id)
+        return df
 
-    # Check if the file is an Excel file
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        logger.error(f"❌ 无效文件类型: {file.filename}")
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload an Excel file.")
+    metadata = file_metadata.get(file_id)
+    if metadata is None or metadata.get("source_path") is None:
+        logger.error(f"❌ 文件ID未找到: {file_id}")
+        raise HTTPException(status_code=404, detail="File ID not found.")
+
+    wait = LOAD_WAIT_SECONDS if metadata.get("status") == "loading" else -1
+    df = _materialize_sheet(file_id, metadata, wait)
+    if df is None:
+        logger.info(f"⏳ 文件仍在后台加载中: {file_id}")
+        raise HTTPException(status_code=503, detail="File is still loading. Please retry shortly.",
+                            headers={"Retry-After": "1"})
+
+    _record_access(file_id)
+    return df
+
+async def _load_dataframe(file_id: str) -> pd.DataFrame:
+    """
+    _get_dataframe for async endpoints: parsing a lazily registered sheet, or waiting up to
+    LOAD_WAIT_SECONDS for a background load, runs in the thread pool instead of the event loop.
+    """
+    _sync_shared_file(file_id)
+    df = data_storage.get(file_id)
+    if df is not None:
+        _record_access(file_id)
+        return df
+    return await run_in_threadpool(_get_dataframe, file_id)
+
+def _stored_file_ids() -> List[str]:
+    """
+    Returns the IDs of all stored files, including lazily registered sheets not parsed yet.
+    """
+    file_ids = list(data_storage)
+    file_ids.extend(file_id for file_id in file_metadata if file_id not in data_storage)
+    return file_ids
+
+def _materialize_sheet(file_id: str, metadata: Dict[str, Any], wait: float = -1) -> Optional[pd.DataFrame]:
+    """
+    Parses a lazily registered sheet from its spooled workbook and caches it in storage.
+    Returns None if another thread is parsing the sheet and it does not finish within `wait` seconds.
+    """
+    lock = _materialize_locks.setdefault(file_id, threading.Lock())
+    if not lock.acquire(timeout=wait):
+        return None
+
+    try:
+        df = data_storage.get(file_id)
+        if df is not None:
+            return df
+
+        # 等待期间文件可能已被删除或覆盖保存
+        source_path = metadata.get("source_path")
+        if file_metadata.get(file_id) is not metadata or source_path is None:
+            raise HTTPException(status_code=404, detail="File ID not found.")
+
+        logger.info(f"🔄 开始解析工作表 '{metadata['sheet_name']}': {file_id}")
+        try:
+            df = pd.read_excel(source_path, sheet_name=metadata["sheet_name"])
+        except Exception as e:
+            metadata["status"] = "failed"
+            logger.error(f"❌ 解析工作表 '{metadata['sheet_name']}' 失败: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error loading sheet: {e}")
+
+        df = _ingest_dataframe(df, metadata, file_id)
+        metadata["source_path"] = None
+        metadata["status"] = "ready"
+        metadata["rows"] = len(df)
+        metadata["headers"] = df.columns.tolist()
+        data_storage.put(file_id, df, metadata)
+        _release_lazy_source(file_id, source_path)
+
+        logger.info(f"✅ 工作表 '{metadata['sheet_name']}' 解析完成，数据形状: {df.shape}")
+        return df
+
+    finally:
+        lock.release()
+        _materialize_locks.pop(file_id, None)
+
+def _load_pending_sheets(file_ids: List[str]):
+    """
+    Background task: fully loads the sheets registered by a preview upload.
+    """
+    for file_id in file_ids:
+        metadata = file_metadata.get(file_id)
+        if metadata is None or file_id in data_storage:
+            continue
+        try:
+            _materialize_sheet(file_id, metadata)
+        except HTTPException:
+            # 已删除或解析失败，错误已记录
+            continue
+
+def _release_lazy_source(file_id: str, source_path: str):
+    """
+    Drops a file ID from its workbook's pending set, removing the spooled workbook once no sheet needs it.
+    """
+    pending = lazy_sources.get(source_path)
+    if pending is None:
+        return
+
+    pending.discard(file_id)
+    if not pending:
+        del lazy_sources[source_path]
+        if os.path.exists(source_path):
+            os.remove(source_path)
+        logger.info(f"🧹 工作簿所有工作表已解析或删除，移除落盘文件: {source_path}")
+
+def _register_lazy_workbook(path: str, filename: str, preview_rows: int = 0) -> List[Dict[str, Any]]:
+    """
+    Registers every sheet of a spooled .xlsx workbook with only its headers and dimensions.
+    Sheets are parsed by _get_dataframe the first time an endpoint reads them.
+    With preview_rows, the first rows of each sheet are read for the preview and the
+    sheets are marked as loading, for a background task to parse in full.
+    """
+    excel_file = pd.ExcelFile(path)
+    sheet_names = excel_file.sheet_names
+    logger.info(f"📋 发现 {len(sheet_names)} 个工作表，延迟解析: {sheet_names}")
+
+    uploaded_files = []
+    pending = set()
+
+    for sheet_name in sheet_names:
+        try:
+            # 只读模式下取工作表声明的尺寸，不遍历数据行；需在parse之前读取，parse会重置尺寸
+            max_row = excel_file.book[sheet_name].max_row
+            # 只读取表头和前几行，不会加载整个工作表
+            preview_df = excel_file.parse(sheet_name, nrows=preview_rows)
+            rows = max(max_row - 1, 0) if max_row is not None else None
+        except Exception as sheet_error:
+            logger.error(f"❌ 读取工作表 '{sheet_name}' 信息时出错: {str(sheet_error)}")
+            continue
+
+        headers = preview_df.columns.tolist()
+        status = "loading" if preview_rows else "pending"
+
+        file_id = str(uuid.uuid4())
+        file_metadata[file_id] = {
+            "original_filename": filename,
+            "sheet_name": sheet_name,
+            "upload_time": pd.Timestamp.now().isoformat(),
+            "version": 1,
+            "source_path": path,
+            "status": status,
+            "rows": rows,
+            "headers": headers
+        }
+        pending.add(file_id)
+
+        uploaded_files.append({
+            "file_id": file_id,
+            "filename": f"{filename} - {sheet_name}" if len(sheet_names) > 1 else filename,
+            "original_filename": filename,
+            "sheet_name": sheet_name,
+            "headers": headers,
+            "preview_data": _to_records(preview_df),
+            "rows": rows,
+            "columns": len(headers),
+            "lazy": True,
+            "status": status
+        })
+        logger.info(f"🆔 工作表 '{sheet_name}' 已登记: {file_id}, 约 {rows} 行 × {len(headers)} 列")
+
+    excel_file.close()
+
+    if pending:
+        lazy_sources[path] = pending
+
+    return uploaded_files
+
+def _to_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    Converts a DataFrame to JSON-compatible records, with NaN/NaT as None for every dtype.
+    """
+    # 先转为object，category等类型的where(..., None)不会把缺失值替换为None
+    return df.astype(object).where(pd.notnull(df), None).to_dict(orient='records')
+
+def _json_value(value: Any) -> str:
+    # 逐值编码的后备路径，只用于扩展类型和混合类型的object列
+    if value is None or value is pd.NaT:
+        return "null"
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, str):
+        return encode_basestring(value)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float):
+        return repr(value) if np.isfinite(value) else "null"
+    if isinstance(value, int):
+        return str(value)
+    return json.dumps(jsonable_encoder(value), ensure_ascii=False)
+
+_json_values = np.frompyfunc(_json_value, 1, 1)
+_json_strings = np.frompyfunc(encode_basestring, 1, 1)
+
+def _json_fragments(series: pd.Series) -> np.ndarray:
+    """
+    Encodes a column as an object array of JSON value strings, with NaN/NaT as null.
+    Numeric, boolean, datetime, string and categorical columns are formatted by NumPy in bulk.
+    """
+    dtype = series.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in "iu":
+        return series.to_numpy().astype(str).astype(object)
+
+    if isinstance(dtype, np.dtype) and dtype.kind == "b":
+        return np.where(series.to_numpy(), "true", "false").astype(object)
+
+    if isinstance(dtype, np.dtype) and dtype.kind == "f":
+        # float32先转为float64，与Python float的repr一致；inf在JSON中也没有表示，同样为null
+        array = series.to_numpy().astype(np.float64, copy=False)
+        return np.where(np.isfinite(array), array.astype(str), "null").astype(object)
+
+    if isinstance(dtype, np.dtype) and dtype.kind == "M":
+        array = series.to_numpy()
+        nulls = np.isnat(array)
+        # 整秒的时间与Timestamp.isoformat()格式相同
+        if not (array[~nulls].astype("datetime64[ns]").view(np.int64) % 1_000_000_000).any():
+            text = np.char.add(np.char.add('"', np.datetime_as_string(array, unit="s")), '"')
+            return np.where(nulls, "null", text).astype(object)
+
+    if isinstance(dtype, pd.CategoricalDtype):
+        # 每个类别只编码一次，再按编码取值
+        categories = _json_fragments(pd.Series(dtype.categories))
+        codes = series.cat.codes.to_numpy()
+        return np.append(categories, "null")[np.where(codes < 0, len(categories), codes)]
+
+    if pd.api.types.is_string_dtype(dtype) and dtype != object:
+        nulls = series.isna().to_numpy()
+        text = _json_strings(series.to_numpy(dtype=object, na_value=""))
+        text[nulls] = "null"
+        return text
+
+    return _json_values(series.to_numpy(dtype=object, na_value=None))
+
+def _json_rows(df: pd.DataFrame) -> List[str]:
+    """
+    Encodes each row of a DataFrame as a JSON object string from its encoded columns.
+    """
+    fragments = [_json_fragments(df.iloc[:, position]) for position in range(df.shape[1])]
+    # 键只编码一次，每行只做一次%格式化
+    template = "{" + ",".join(encode_basestring(str(column)).replace("%", "%%") + ":%s" for column in df.columns) + "}"
+    return [template % values for values in zip(*fragments)]
+
+def _records_json(df: pd.DataFrame) -> str:
+    """
+    Serializes a DataFrame as a JSON array of row objects, equivalent to encoding _to_records(df)
+    but without the object-dtype copy, to_dict and jsonable_encoder passes.
+    """
+    return "[" + ",".join(_json_rows(df)) + "]"
+
+def _raw_json_response(fields: Dict[str, Any], raw_fields: Dict[str, str],
+                       headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Returns a JSON object response from plain fields and already encoded JSON fields.
+    """
+    parts = [encode_basestring(str(key)) + ":" + json.dumps(value, ensure_ascii=False)
+             for key, value in jsonable_encoder(fields).items()]
+    parts.extend(encode_basestring(key) + ":" + value for key, value in raw_fields.items())
+    return Response(content=("{" + ",".join(parts) + "}").encode("utf-8"), media_type="application/json", headers=headers)
+
+def _column_values(series: pd.Series) -> List[Any]:
+    """
+    Converts a column to a list of JSON-native values, with NaN/NaT as None.
+    Numeric columns are converted from their NumPy array in one step.
+    """
+    dtype = series.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in "iub":
+        return series.to_numpy().tolist()
+
+    if isinstance(dtype, np.dtype) and dtype.kind == "f":
+        array = series.to_numpy()
+        # inf在JSON中没有表示，与NaN一样返回None
+        nulls = ~np.isfinite(array)
+        if not nulls.any():
+            return array.tolist()
+        values = array.astype(object)
+        values[nulls] = None
+        return values.tolist()
+
+    values = series.to_numpy(dtype=object, na_value=None)
+    if pd.api.types.is_datetime64_any_dtype(dtype) or pd.api.types.is_timedelta64_dtype(dtype):
+        return [None if value is None else value.isoformat() for value in values.tolist()]
+    if dtype == object:
+        # 混合类型的列可能包含日期等非JSON原生对象
+        return jsonable_encoder(values.tolist())
+    return values.tolist()
+
+def _to_columns(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Converts a DataFrame to the columnar JSON format: {"columns": [...], "data": {column: [...]}}.
+    """
+    return {
+        "columns": df.columns.tolist(),
+        "data": {str(column): _column_values(df.iloc[:, position]) for position, column in enumerate(df.columns)}
+    }
+
+def _columnar_preview(file_info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns an upload file info with its preview rows in the columnar JSON format.
+    """
+    headers = file_info["headers"]
+    records = file_info["preview_data"]
+    preview = {"columns": headers, "data": {str(header): [record.get(header) for record in records] for header in headers}}
+    return {**file_info, "preview_data": preview}
+
+def _negotiate_format(accept: Optional[str], format: Optional[str],
+                      allowed: Tuple[str, ...] = ("records", "columnar", "arrow", "float64", "ndjson")) -> str:
+    """
+    Returns the response format of a request: the format query parameter if given,
+    otherwise the first supported media type of the Accept header, defaulting to records.
+    """
+    if format is not None:
+        if format not in allowed:
+            raise HTTPException(status_code=400, detail=f"Invalid format '{format}'. Use one of: {', '.join(allowed)}.")
+        return format
+    for media_type in (accept or "").split(","):
+        response_format = RESPONSE_FORMATS.get(media_type.split(";")[0].strip())
+        if response_format in allowed:
+            return response_format
+    return "records"
+
+def _arrow_stream(df: pd.DataFrame) -> bytes:
+    """
+    Serializes a DataFrame as an Arrow IPC stream; numeric column buffers are copied as is.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(status_code=406, detail="Arrow responses are not available: pyarrow is not installed.")
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        raise HTTPException(status_code=406, detail=f"Data cannot be encoded as Arrow: {e}")
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def _float64_buffer(columns: List[pd.Series]) -> bytes:
+    """
+    Concatenates numeric columns as little-endian Float64 buffers, with nulls as NaN.
+    """
+    for series in columns:
+        if not pd.api.types.is_numeric_dtype(series.dtype):
+            raise HTTPException(status_code=406, detail=f"Column '{series.name}' is not numeric and cannot be sent as Float64.")
+    length = len(columns[0]) if columns else 0
+    buffer = np.empty((len(columns), length), dtype="<f8")
+    for target, series in zip(buffer, columns):
+        target[:] = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    return buffer.tobytes()
+
+def _binary_response(df: pd.DataFrame, response_format: str, headers: Dict[str, str]) -> Response:
+    """
+    Returns the rows of a DataFrame as an Arrow IPC stream or as column-major Float64 buffers.
+    X-Columns lists the columns (JSON, ASCII-escaped) and X-Row-Count the rows of each buffer.
+    """
+    if response_format == "arrow":
+        body, media_type = _arrow_stream(df), ARROW_STREAM_MEDIA_TYPE
+    else:
+        body, media_type = _float64_buffer([df.iloc[:, position] for position in range(df.shape[1])]), FLOAT64_MEDIA_TYPE
+    headers = {
+        "Vary": "Accept",
+        "X-Columns": json.dumps([str(column) for column in df.columns]),
+        "X-Row-Count": str(len(df)),
+        **headers
+    }
+    return Response(content=body, media_type=media_type, headers=headers)
+
+def _ndjson_lines(df: pd.DataFrame, rows: Optional[np.ndarray] = None) -> Iterator[str]:
+    """
+    Yields the rows of a DataFrame, or only the given row positions, as NDJSON.
+    Gathers and serializes STREAM_BATCH_ROWS rows at a time.
+    """
+    total = len(df) if rows is None else len(rows)
+    for start in range(0, total, STREAM_BATCH_ROWS):
+        stop = start + STREAM_BATCH_ROWS
+        batch = df.iloc[start:stop] if rows is None else df.iloc[rows[start:stop]]
+        yield "\n".join(_json_rows(batch)) + "\n"
+
+def _ndjson_response(df: pd.DataFrame, headers: Dict[str, str], rows: Optional[np.ndarray] = None) -> StreamingResponse:
+    """
+    Streams the rows of a DataFrame, or only the given row positions, as NDJSON;
+    only one batch is gathered and serialized in memory at a time.
+    """
+    headers = {
+        "Vary": "Accept",
+        "X-Columns": json.dumps([str(column) for column in df.columns]),
+        "X-Row-Count": str(len(df) if rows is None else len(rows)),
+        **headers
+    }
+    return StreamingResponse(_ndjson_lines(df, rows), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+def _page_headers(page: Dict[str, Any]) -> Dict[str, str]:
+    # 二进制响应的分页信息放在响应头中
+    headers = {"X-Total-Count": str(page["total"])}
+    if page["next_cursor"] is not None:
+        headers["X-Next-Cursor"] = page["next_cursor"]
+    return headers
+
+def _columnar_response(content: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    # 内容已是JSON原生类型，跳过jsonable_encoder的逐值遍历
+    return JSONResponse(content=content, media_type=COLUMNAR_MEDIA_TYPE, headers={"Vary": "Accept", **(headers or {})})
+
+def _json_scalar(value):
+    """
+    Converts a NumPy scalar to the equivalent Python value for JSON responses.
+    """
+    return value.item() if isinstance(value, np.generic) else value
+
+def _build_column_catalog(df: pd.DataFrame) -> Dict[Any, Dict[str, Any]]:
+    """
+    Computes per-column statistics: dtype, null count, min/max, cardinality, numeric
+    coercibility, top values and, for low-cardinality columns, the full list of unique values.
+    """
+    catalog = {}
+    for position, column in enumerate(df.columns):
+        # 按位置取列，列名重复时df[column]返回DataFrame；重复的列名只记录第一列
+        if column in catalog:
+            continue
+        series = df.iloc[:, position]
+        non_null = series.dropna()
+
+        numeric = pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype)
+        if numeric:
+            numeric_count = len(non_null)
+        else:
+            values = non_null.astype(object) if isinstance(series.dtype, pd.CategoricalDtype) else non_null
+            numeric_count = int(pd.to_numeric(values, errors='coerce').notna().sum())
+
+        counts = non_null.value_counts()
+        counts = counts[counts > 0]
+        orderable = numeric or pd.api.types.is_datetime64_any_dtype(series.dtype)
+
+        catalog[column] = {
+            "name": column,
+            "dtype": str(series.dtype),
+            "null_count": int(len(series) - len(non_null)),
+            "min": _json_scalar(non_null.min()) if orderable and len(non_null) else None,
+            "max": _json_scalar(non_null.max()) if orderable and len(non_null) else None,
+            "cardinality": len(counts),
+            "numeric": numeric,
+            "numeric_count": numeric_count,
+            "numeric_coercible": len(non_null) > 0 and numeric_count == len(non_null),
+            "top_values": [{"value": _json_scalar(value), "count": int(count)}
+                           for value, count in counts.head(CATALOG_TOP_VALUES).items()],
+            "unique_values": non_null.unique().tolist() if len(counts) <= CATALOG_MAX_UNIQUE else None
+        }
+
+    return catalog
+
+def _get_column_catalog(file_id: str, df: pd.DataFrame) -> Dict[Any, Dict[str, Any]]:
+    """
+    Returns the column catalog of a file, building it if the file has none yet.
+    """
+    catalog = column_catalog.get(file_id)
+    if catalog is None:
+        catalog = _build_column_catalog(df)
+        column_catalog[file_id] = catalog
+    return catalog
+
+def _get_column_index(file_id: str, column: Any, stats: Dict[str, Any]) -> ColumnIndex:
+    """
+    Returns the filter index of a column for the file's current version, creating it if needed.
+    """
+    version = _dataset_version(file_id)
+    indexes = filter_indexes.get(file_id)
+    if indexes is None or indexes["version"] != version:
+        indexes = {"version": version, "columns": {}}
+        filter_indexes[file_id] = indexes
+
+    index = indexes["columns"].get(column)
+    if index is None:
+        index = ColumnIndex(stats["numeric"])
+        indexes["columns"][column] = index
+    return index
+
+def _filter_cache_key(file_id: str, mode: str, filters: Dict[str, List[str]],
+                      projection: Optional[Tuple[str, ...]] = None,
+                      expression: Optional[FilterExpression] = None) -> Tuple:
+    """
+    Returns the result cache key of a filter request. Values are deduplicated and sorted; the
+    column order is kept for "filter" mode, where each column's match counts depend on the
+    columns before it, and sorted for "direct" mode, where columns are simply ANDed.
+    """
+    columns = [(str(column), tuple(sorted(set(map(str, values))))) for column, values in filters.items() if values]
+    if mode == "direct":
+        columns.sort()
+    if expression is not None:
+        columns.append(("where", json.dumps(expression.model_dump(), sort_keys=True, default=str)))
+    return (file_id, _dataset_version(file_id), mode, tuple(columns), projection)
+
+def _filter_rows(file_id: str, df: pd.DataFrame, filters: Dict[str, List[str]],
+                 ignore_missing: bool = False, projection: Optional[Tuple[str, ...]] = None,
+                 expression: Optional[FilterExpression] = None) -> Optional[np.ndarray]:
+    """
+    Evaluates direct isin() filters through the column indexes, ANDing the columns and
+    then the filter expression, if any.
+    Returns the ascending positions of the matching rows, or None if no filter applies.
+    Raises 400 for a missing filter column unless ignore_missing is set.
+    Results are cached per dataset version.
+    """
+    if not ignore_missing:
+        for column in filters:
+            if column not in df.columns:
+                raise HTTPException(status_code=400, detail=f"Filter column '{column}' not found in data.")
+
+    cache_key = _filter_cache_key(file_id, "direct", {column: values for column, values in filters.items()
+                                                      if column in df.columns}, projection, expression)
+    if not cache_key[3]:
+        return None
+    rows = filter_cache.get(cache_key)
+    if rows is not None:
+        return rows
+
+    catalog = _get_column_catalog(file_id, df)
+    candidates = None
+    for column, values in filters.items():
+        if column in df.columns and values:  # Ensure there are values to filter by
+            index = _get_column_index(file_id, column, catalog[column])
+            candidates = _match_rows(index, "direct", df[column], values, candidates)
+
+    rows = _apply_expression(file_id, df, expression,
+                             _candidate_positions(candidates, len(df)) if candidates is not None else None)
+    filter_cache.put(cache_key, rows)
+    return rows
+
+# 表达式运算符：比较类运算符作用于单列，逻辑运算符组合子表达式
+COMPARISON_OPERATORS = ("==", "!=", ">", ">=", "<", "<=", "between", "in", "not in", "is null", "is not null", "contains")
+LOGICAL_OPERATORS = ("and", "or", "not")
+
+def _expression_error(message: str):
+    raise HTTPException(status_code=400, detail=f"Invalid filter expression: {message}")
+
+def _comparison_operand(series: pd.Series, stats: Dict[str, Any], value: Any) -> Any:
+    """
+    Returns the operand of an ordering comparison: a number for numeric or numeric-coercible
+    columns, a timestamp for datetime columns, and the raw value otherwise.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        try:
+            return pd.Timestamp(value)
+        except (ValueError, TypeError):
+            _expression_error(f"'{value}' is not a valid timestamp for column '{series.name}'")
+
+    if stats["numeric"] or (stats["numeric_coercible"] and not isinstance(value, str)):
+        try:
+            return float(value)
+        except (ValueError, TypeError):
+            _expression_error(f"'{value}' is not a number for column '{series.name}'")
+
+    return value
+
+def _range_mask_from_stats(stats: Dict[str, Any], op: str, low: Any, high: Any, rows: int) -> Optional[np.ndarray]:
+    """
+    Decides an ordering comparison on a numeric column from its catalog min/max when every row
+    has the same outcome. Returns None when the rows have to be compared.
+    """
+    if not stats["numeric"] or stats["min"] is None:
+        return None
+
+    column_min, column_max = stats["min"], stats["max"]
+    if op == ">":
+        all_match, none_match = column_min > low, column_max <= low
+    elif op == ">=":
+        all_match, none_match = column_min >= low, column_max < low
+    elif op == "<":
+        all_match, none_match = column_max < low, column_min >= low
+    elif op == "<=":
+        all_match, none_match = column_max <= low, column_min > low
+    else:
+        all_match, none_match = low <= column_min and column_max <= high, column_max < low or column_min > high
+    if none_match:
+        return np.zeros(rows, dtype=bool)
+    # 空值不满足任何比较
+    if all_match and stats["null_count"] == 0:
+        return np.ones(rows, dtype=bool)
+    return None
+
+def _evaluate_comparison(file_id: str, df: pd.DataFrame, catalog: Dict[Any, Dict[str, Any]],
+                         expression: "FilterExpression") -> np.ndarray:
+    column, op, value = expression.column, expression.op, expression.value
+    if column is None:
+        _expression_error(f"operator '{op}' needs a column")
+    if column not in df.columns:
+        raise HTTPException(status_code=400, detail=f"Filter column '{column}' not found in data.")
+
+    series = df[column]
+    stats = catalog[column]
+    rows = len(df)
+
+    if op in ("is null", "is not null"):
+        if stats["null_count"] == 0:
+            return np.full(rows, op == "is not null")
+        mask = series.isna().to_numpy()
+        return mask if op == "is null" else ~mask
+
+    # 空值不满足任何比较，与null比较须使用is null / is not null
+    if value is None or (isinstance(value, list) and any(operand is None for operand in value)):
+        _expression_error(f"operator '{op}' cannot compare with null, use 'is null' or 'is not null'")
+
+    if op in ("==", "!=", "in", "not in"):
+        values = value if op in ("in", "not in") else [value]
+        if not isinstance(values, list):
+            _expression_error(f"operator '{op}' needs a list of values")
+        if stats["numeric"]:
+            try:
+                values = [float(v) for v in values]
+            except (ValueError, TypeError):
+                _expression_error(f"values of '{op}' must be numbers for column '{column}'")
+
+        # 通过列索引只比较唯一值；不等于和不在列表中都不匹配空值
+        index = _get_column_index(file_id, column, stats)
+        mask = np.zeros(rows, dtype=bool)
+        mask[_candidate_positions(_match_rows(index, "direct", series, values, None), rows)] = True
+        if op in ("!=", "not in"):
+            mask = ~mask
+            if stats["null_count"]:
+                mask &= series.notna().to_numpy()
+        return mask
+
+    if op == "contains":
+        if not isinstance(value, str):
+            _expression_error("operator 'contains' needs a string")
+        index = _get_column_index(file_id, column, stats)
+        rows_matched = index.match_keys("string", series, lambda keys: keys.str.contains(value, regex=False), None)
+        mask = np.zeros(rows, dtype=bool)
+        mask[rows_matched] = True
+        # 空值的字符串形式不参与匹配
+        if stats["null_count"]:
+            mask &= series.notna().to_numpy()
+        return mask
+
+    # 范围比较
+    if op == "between":
+        if not isinstance(value, list) or len(value) != 2:
+            _expression_error("operator 'between' needs [low, high]")
+        low, high = (_comparison_operand(series, stats, bound) for bound in value)
+    else:
+        low, high = _comparison_operand(series, stats, value), None
+
+    if isinstance(low, float):
+        decided = _range_mask_from_stats(stats, op, low, high, rows)
+        if decided is not None:
+            return decided
+        # 可转换为数字的文本列按数值比较
+        if not stats["numeric"]:
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                series = series.astype(object)
+            series = pd.to_numeric(series, errors='coerce')
 
     try:
-        logger.info("🔄 开始读取Excel文件...")
+        if op == "between":
+            mask = (series >= low) & (series <= high)
+        else:
+            mask = {">": series.__gt__, ">=": series.__ge__, "<": series.__lt__, "<=": series.__le__}[op](low)
+    except TypeError as e:
+        _expression_error(f"cannot compare column '{column}' with {value!r}: {e}")
+    return mask.fillna(False).to_numpy(dtype=bool)
 
-        # 首先读取所有sheet名称
-        excel_file = pd.ExcelFile(file.file)
-        sheet_names = excel_file.sheet_names
-        logger.info(f"📋 发现 {len(sheet_names)} 个工作表: {sheet_names}")
+def _evaluate_expression(file_id: str, df: pd.DataFrame, catalog: Dict[Any, Dict[str, Any]],
+                         expression: "FilterExpression") -> np.ndarray:
+    """
+    Evaluates a filter expression tree into a boolean mask over all rows. Each comparison is
+    one vectorized operation; "and"/"or" stop early once the result can no longer change.
+    """
+    op = expression.op
+    if op in LOGICAL_OPERATORS:
+        if op == "not":
+            if len(expression.args) != 1:
+                _expression_error("operator 'not' needs exactly one argument")
+            return ~_evaluate_expression(file_id, df, catalog, expression.args[0])
+        if not expression.args:
+            _expression_error(f"operator '{op}' needs at least one argument")
+
+        mask = _evaluate_expression(file_id, df, catalog, expression.args[0])
+        for argument in expression.args[1:]:
+            if op == "and" and not mask.any():
+                break
+            if op == "or" and mask.all():
+                break
+            other = _evaluate_expression(file_id, df, catalog, argument)
+            mask = mask & other if op == "and" else mask | other
+        return mask
+
+    if op not in COMPARISON_OPERATORS:
+        _expression_error(f"unknown operator '{op}'")
+    return _evaluate_comparison(file_id, df, catalog, expression)
+
+def _apply_expression(file_id: str, df: pd.DataFrame, expression: Optional["FilterExpression"],
+                      rows: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """
+    Narrows the matching row positions (None for all rows) to those satisfying the expression.
+    """
+    if expression is None:
+        return rows
+    mask = _evaluate_expression(file_id, df, _get_column_catalog(file_id, df), expression)
+    return np.flatnonzero(mask) if rows is None else rows[mask[rows]]
+
+def _project_columns(df: pd.DataFrame, columns: Optional[List[str]]) -> pd.DataFrame:
+    """
+    Returns the DataFrame restricted to the requested columns, in request order without
+    duplicates, or unchanged when no columns are requested. Raises 400 for unknown columns.
+    """
+    if not columns:
+        return df
+    missing = [column for column in columns if column not in df.columns]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Columns not found in data: {missing}")
+    return df[list(dict.fromkeys(columns))]
+
+def _encode_cursor(file_id: str, version: int, query: str, offset: int) -> str:
+    state = json.dumps({"f": file_id, "v": version, "q": query, "o": offset}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(state.encode()).decode().rstrip("=")
+
+def _resolve_page(file_id: str, version: int, query: str, total: int, offset: Optional[int],
+                  limit: Optional[int], cursor: Optional[str]) -> Dict[str, Any]:
+    """
+    Returns the row range of a page from an offset/limit or from an opaque cursor returned by the
+    previous page, with the cursor of the next page. Pages hold at most MAX_PAGE_ROWS rows.
+    A cursor from another file or query is rejected with 400, one from an older version with 409.
+    """
+    if cursor is not None:
+        try:
+            state = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            cursor_file_id, cursor_version, cursor_query, offset = state["f"], state["v"], state["q"], int(state["o"])
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+        if cursor_file_id != file_id or cursor_query != query:
+            raise HTTPException(status_code=400, detail="Cursor does not belong to this request.")
+        if cursor_version != version:
+            raise HTTPException(status_code=409, detail="The data changed since the first page. Restart from the first page.")
+
+    offset = offset or 0
+    limit = MAX_PAGE_ROWS if limit is None else limit
+    if offset < 0 or limit <= 0:
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit must be > 0.")
+    limit = min(limit, MAX_PAGE_ROWS)
+
+    start = min(offset, total)
+    stop = min(start + limit, total)
+    return {
+        "start": start,
+        "stop": stop,
+        "total": total,
+        "offset": start,
+        "limit": limit,
+        "next_cursor": _encode_cursor(file_id, version, query, stop) if stop < total else None
+    }
 
-        uploaded_files = []
+def _filter_index_bytes(file_id: str) -> int:
+    indexes = filter_indexes.get(file_id)
+    return sum(index.nbytes() for index in indexes["columns"].values()) if indexes else 0
+
+def _column_bytes(df: pd.DataFrame) -> Dict[str, int]:
+    """
+    Returns the deep memory size of each column, keyed by column name as a string.
+    """
+    return {str(column): int(size) for column, size in df.memory_usage(deep=True, index=False).items()}
+
+def _catalog_bytes(file_id: str) -> int:
+    """
+    Estimates the memory held by a file's column catalog from its JSON size.
+    """
+    catalog = column_catalog.get(file_id)
+    return len(json.dumps(catalog, default=str)) if catalog else 0
+
+def _versions_bytes(file_id: Optional[str] = None) -> int:
+    return sum(entry["bytes"] for key, entry in dataset_versions.items() if file_id is None or key[0] == file_id)
+
+def _check_memory_quota(size: int, replacing: int = 0):
+    """
+    Rejects a new frame of `size` bytes that exceeds the per-file quota (413) or, after dropping
+    retained versions, would push stored data over the global quota (507).
+    `replacing` is the size of a frame the new one replaces.
+    """
+    if FILE_QUOTA_BYTES and size > FILE_QUOTA_BYTES:
+        logger.warning(f"🚫 数据大小 {size} bytes 超出单文件配额 {FILE_QUOTA_BYTES} bytes")
+        raise HTTPException(status_code=413, detail=f"Dataset needs {size} bytes, exceeding the per-file quota of {FILE_QUOTA_BYTES} bytes.")
+
+    if not GLOBAL_QUOTA_BYTES:
+        return
+
+    # 优先丢弃可重建的历史版本，仍超出时拒绝
+    while data_storage.total_bytes() + _versions_bytes() - replacing + size > GLOBAL_QUOTA_BYTES and dataset_versions:
+        key, _ = dataset_versions.popitem(last=False)
+        logger.info(f"🧹 内存总量超出配额，丢弃历史版本: {key[0]} v{key[1]}")
+
+    total = data_storage.total_bytes() + _versions_bytes() - replacing + size
+    if total > GLOBAL_QUOTA_BYTES:
+        logger.warning(f"🚫 存储总量 {total} bytes 将超出全局配额 {GLOBAL_QUOTA_BYTES} bytes")
+        raise HTTPException(status_code=507, detail=f"Storing this dataset would exceed the global memory quota of {GLOBAL_QUOTA_BYTES} bytes. "
+                                                    "Delete some files and retry.")
+
+def _optimize_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns a memory-compact copy of a freshly ingested DataFrame.
+    Low-cardinality string columns become categoricals, other string columns use the
+    nullable string dtype, and integers/floats are downcast only where no value changes.
+    """
+    optimized = {}
+    for column in df.columns:
+        series = df[column]
+
+        if series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+            values = series.dropna()
+            if series.dtype == object and not values.map(type).eq(str).all():
+                # 混合类型的列保持原样
+                optimized[column] = series
+            elif len(values) and values.nunique() <= CATEGORY_MAX_RATIO * len(series):
+                optimized[column] = series.astype("category")
+            elif series.dtype == object:
+                optimized[column] = series.astype(pd.StringDtype())
+            else:
+                optimized[column] = series
+
+        elif isinstance(series.dtype, np.dtype) and series.dtype.kind in "iu":
+            optimized[column] = pd.to_numeric(series, downcast="integer")
+
+        elif series.dtype == np.float64:
+            values = series.to_numpy()
+            narrowed = values.astype(np.float32)
+            # float32往返后数值不变才降精度
+            if np.array_equal(narrowed.astype(np.float64), values, equal_nan=True):
+                optimized[column] = pd.Series(narrowed, index=series.index, name=column)
+            else:
+                optimized[column] = series
 
+        else:
+            optimized[column] = series
+
+    result = pd.DataFrame(optimized, index=df.index)
+    result.columns = df.columns
+    return result
+
+def _hash_dataframe(df: pd.DataFrame) -> Optional[str]:
+    """
+    Returns a content hash of a DataFrame's columns, dtypes and values, or None if it cannot be hashed.
+    """
+    try:
+        digest = hashlib.sha256()
+        digest.update(json.dumps([str(column) for column in df.columns]).encode())
+        digest.update(json.dumps([str(dtype) for dtype in df.dtypes]).encode())
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+    except Exception as e:
+        logger.warning(f"⚠️ 无法计算数据哈希，跳过去重: {str(e)}")
+        return None
+
+def _find_shared_frame(sheet_hash: str) -> Optional[str]:
+    """
+    Returns the ID of a stored file whose frame has the given content hash, if any.
+    """
+    for file_id in list(shared_frames.get(sheet_hash, ())):
+        _sync_shared_file(file_id)
+        if file_id in data_storage:
+            return file_id
+    return None
+
+def _release_frame(file_id: str, metadata: Optional[Dict[str, Any]]):
+    """
+    Drops a file ID's reference to its shared frame, forgetting the hash once no file uses it.
+    """
+    sheet_hash = metadata.pop("sheet_hash", None) if metadata is not None else None
+    refs = shared_frames.get(sheet_hash)
+    if refs is None:
+        return
+
+    refs.discard(file_id)
+    if not refs:
+        del shared_frames[sheet_hash]
+        logger.info(f"🧹 共享数据已无引用，释放: {sheet_hash[:12]}")
+
+def _ingest_dataframe(df: pd.DataFrame, metadata: Dict[str, Any], file_id: str) -> pd.DataFrame:
+    """
+    Prepares a parsed DataFrame for storage, recording its memory footprint on the file metadata.
+    A sheet whose content matches an already stored frame shares that frame instead.
+    """
+    sheet_hash = _hash_dataframe(df)
+    if sheet_hash is not None:
+        metadata["sheet_hash"] = sheet_hash
+        shared_file_id = _find_shared_frame(sheet_hash)
+        shared_frames.setdefault(sheet_hash, set()).add(file_id)
+
+        if shared_file_id is not None:
+            shared_metadata = file_metadata.get(shared_file_id, {})
+            metadata["memory_bytes"] = shared_metadata.get("memory_bytes", 0)
+            metadata["memory_saved_bytes"] = shared_metadata.get("memory_saved_bytes", 0)
+            metadata["column_bytes"] = shared_metadata.get("column_bytes", {})
+            logger.info(f"♻️ 数据内容与 {shared_file_id} 相同，共享已存储的DataFrame")
+            shared_df = data_storage[shared_file_id]
+            column_catalog[file_id] = _get_column_catalog(shared_file_id, shared_df)
+            metadata["rows"] = len(shared_df)
+            metadata["headers"] = shared_df.columns.tolist()
+            return shared_df
+
+    memory_before = int(df.memory_usage(deep=True).sum())
+    if OPTIMIZE_DTYPES:
+        df = _optimize_dtypes(df)
+    memory_after = int(df.memory_usage(deep=True).sum())
+    try:
+        _check_memory_quota(memory_after)
+    except HTTPException:
+        _release_frame(file_id, metadata)
+        raise
+
+    metadata["memory_bytes"] = memory_after
+    metadata["column_bytes"] = _column_bytes(df)
+    metadata["memory_saved_bytes"] = memory_before - memory_after
+    metadata["rows"] = len(df)
+    metadata["headers"] = df.columns.tolist()
+    if memory_before > memory_after:
+        logger.info(f"🗜️ 列类型压缩: {memory_before} -> {memory_after} bytes (节省 {memory_before - memory_after} bytes)")
+
+    column_catalog[file_id] = _build_column_catalog(df)
+    return df
+
+def _build_file_info(file_id: str, df: pd.DataFrame, metadata: Dict[str, Any], multiple_sheets: bool) -> Dict[str, Any]:
+    """
+    Builds the upload file info for a stored file, with a preview of its first rows.
+    """
+    filename = metadata["original_filename"]
+    sheet_name = metadata["sheet_name"]
+
+    # 获取表头
+    headers = df.columns.tolist()
+
+    # 获取预览数据（前5行）
+    preview_df = df.head()
+    preview_data = _to_records(preview_df)
+
+    # 构建文件信息
+    return {
+        "file_id": file_id,
+        "filename": f"{filename} - {sheet_name}" if multiple_sheets else filename,
+        "original_filename": filename,
+        "sheet_name": sheet_name,
+        "headers": headers,
+        "preview_data": preview_data,
+        "rows": len(df),
+        "columns": len(headers),
+        "memory_bytes": metadata["memory_bytes"],
+        "memory_saved_bytes": metadata["memory_saved_bytes"],
+        "version": metadata.get("version", 1),
+        "status": metadata.get("status", "ready")
+    }
+
+def _dataset_version(file_id: str) -> int:
+    """
+    Returns the current version of a file's data. Every save increments it.
+    """
+    return file_metadata.get(file_id, {}).get("version", 1)
+
+def _dataset_etag(file_id: str, version: int) -> str:
+    return f'"{file_id}-v{version}"'
+
+def _representation_etag(file_id: str, version: int, response_format: str, columns: Optional[List[Any]],
+                         page: Optional[Dict[str, Any]]) -> str:
+    """
+    Returns the ETag of one representation of a file version: the dataset ETag for the full
+    records response, otherwise one that also identifies the format, projected columns and page.
+    """
+    if response_format == "records" and columns is None and page is None:
+        return _dataset_etag(file_id, version)
+    variant = repr((response_format, columns, (page["offset"], page["limit"]) if page else None))
+    return f'"{file_id}-v{version}-{hashlib.sha256(variant.encode()).hexdigest()[:12]}"'
+
+def _build_saved_frame(previous: Optional[pd.DataFrame], df: pd.DataFrame) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Builds the new version of a saved frame, reusing the previous version's column for every
+    column whose values did not change. Returns the frame and the names of the changed columns.
+    """
+    headers = df.columns.tolist()
+    if previous is None or len(previous) != len(df) or not df.columns.is_unique or not previous.columns.is_unique:
+        return df, headers
+
+    columns = {}
+    changed = []
+    for column in headers:
+        if column in previous.columns:
+            old_column = previous[column].reset_index(drop=True)
+            if old_column.astype(object).equals(df[column].astype(object)):
+                # 未修改的列直接引用旧版本的缓冲区，写时复制保证两个版本互不影响
+                columns[column] = old_column
+                continue
+        columns[column] = df[column]
+        changed.append(column)
+
+    return pd.DataFrame(columns, copy=False), changed
+
+def _retain_version(file_id: str, version: int, df: pd.DataFrame, changed: List[str]):
+    """
+    Keeps a version replaced by a save readable, then drops the oldest retained versions beyond
+    MAX_RETAINED_VERSIONS per file or VERSION_BUDGET_BYTES overall.
+    """
+    if MAX_RETAINED_VERSIONS <= 0:
+        return
+
+    # 与新版本共享的列不额外占用内存，只计算被替换的列
+    replaced = [column for column in changed if column in df.columns]
+    size = int(df[replaced].memory_usage(deep=True, index=False).sum()) if replaced else 0
+    dataset_versions[(file_id, version)] = {"df": df, "bytes": size}
+
+    file_versions = [key for key in dataset_versions if key[0] == file_id]
+    for key in file_versions[:-MAX_RETAINED_VERSIONS]:
+        del dataset_versions[key]
+
+    total = sum(entry["bytes"] for entry in dataset_versions.values())
+    while total > VERSION_BUDGET_BYTES and dataset_versions:
+        key, entry = dataset_versions.popitem(last=False)
+        total -= entry["bytes"]
+        logger.info(f"🧹 历史版本超出内存预算，丢弃: {key[0]} v{key[1]}")
+
+def _drop_versions(file_id: Optional[str] = None):
+    """
+    Forgets the retained versions of a file, or of every file when file_id is None.
+    """
+    for key in list(dataset_versions):
+        if file_id is None or key[0] == file_id:
+            del dataset_versions[key]
+
+def _apply_ttl_policy(file_ids: List[str], ttl_seconds: Optional[float], idle_ttl_seconds: Optional[float]):
+    """
+    Records per-file expiry overrides given at upload time, and starts the files' idle clocks.
+    """
+    now = time.time()
+    for file_id in file_ids:
+        metadata = file_metadata.get(file_id)
+        if metadata is None:
+            continue
+        if ttl_seconds is not None:
+            metadata["ttl_seconds"] = ttl_seconds
+        if idle_ttl_seconds is not None:
+            metadata["idle_ttl_seconds"] = idle_ttl_seconds
+        _record_access(file_id, now)
+        data_storage.save_metadata(file_id, metadata)
+
+def _remove_file(file_id: str) -> int:
+    """
+    Removes a file's data, metadata and derived state. Returns the bytes freed, counting
+    a shared frame only when the last file using it is removed.
+    """
+    frame = data_storage.frame_info(file_id)
+    freed = _versions_bytes(file_id) + _catalog_bytes(file_id)
+    if frame is not None and frame["keys"] == [file_id]:
+        freed += frame["bytes"]
+
+    data_storage.pop(file_id, None)
+    metadata = file_metadata.pop(file_id, None)
+    _release_frame(file_id, metadata)
+    column_catalog.pop(file_id, None)
+    filter_indexes.pop(file_id, None)
+    filter_cache.invalidate(file_id)
+    last_access.pop(file_id, None)
+    _published_access.pop(file_id, None)
+    _drop_versions(file_id)
+    if metadata is not None and metadata.get("source_path"):
+        _release_lazy_source(file_id, metadata["source_path"])
+    return freed
+
+def _expired_file_ids(now: float) -> List[str]:
+    """
+    Returns the files idle longer than their idle TTL or older than their absolute TTL.
+    Per-file TTLs from the upload override IDLE_TTL_SECONDS and ABSOLUTE_TTL_SECONDS.
+    """
+    expired = []
+    # 共享存储中其他进程的读取只记录在索引里
+    shared_access = data_storage.last_access_times() if SHARED_STORE else {}
+    for file_id in _stored_file_ids():
+        metadata = file_metadata.get(file_id, {})
+        # 正在后台加载的数据不清理
+        if metadata.get("status") == "loading":
+            continue
+
+        idle_ttl = metadata.get("idle_ttl_seconds", IDLE_TTL_SECONDS)
+        accessed = max(last_access.setdefault(file_id, now), shared_access.get(file_id, 0))
+        if idle_ttl and now - accessed > idle_ttl:
+            expired.append(file_id)
+            continue
+
+        ttl = metadata.get("ttl_seconds", ABSOLUTE_TTL_SECONDS)
+        upload_time = metadata.get("upload_time")
+        # upload_time是本地时间的ISO字符串；datetime.timestamp()按本地时间换算，与now使用同一时钟
+        if ttl and upload_time and now - pd.Timestamp(upload_time).to_pydatetime().timestamp() > ttl:
+            expired.append(file_id)
+
+    return expired
+
+def _remove_finished_jobs(finished_before: Optional[str] = None) -> int:
+    """
+    Drops completed or failed upload jobs finished before an ISO timestamp (all of them when
+    None), locally and in the shared index. Running jobs are kept so their polling still works.
+    """
+    finished = [
+        job_id for job_id, job in list(upload_jobs.items())
+        if job.get("finished_time") and (finished_before is None or job["finished_time"] < finished_before)
+    ]
+    for job_id in finished:
+        upload_jobs.pop(job_id, None)
+    # 共享索引中可能还有其他worker的任务，删除数以较大者为准
+    return max(len(finished), data_storage.remove_jobs(finished_before))
+
+def _sweep_expired_files(now: Optional[float] = None) -> int:
+    """
+    Removes every expired file and finished upload jobs older than JOB_TTL_SECONDS, and records
+    the sweep in expiry_stats. Returns the number of files removed.
+    """
+    now = now if now is not None else time.time()
+    _sync_shared_files()
+    expired = _expired_file_ids(now)
+    reclaimed = sum(_remove_file(file_id) for file_id in expired)
+    # finished_time是本地时间的ISO字符串，按同样格式比较
+    expired_jobs = _remove_finished_jobs(pd.Timestamp.fromtimestamp(now - JOB_TTL_SECONDS).isoformat())
+
+    expiry_stats["sweeps"] += 1
+    expiry_stats["expired_files"] += len(expired)
+    expiry_stats["expired_jobs"] += expired_jobs
+    expiry_stats["reclaimed_bytes"] += reclaimed
+    expiry_stats["last_sweep_time"] = pd.Timestamp.now().isoformat()
+    if expired:
+        logger.info(f"⏰ 已清理 {len(expired)} 个过期文件，释放 {reclaimed} bytes")
+    if expired_jobs:
+        logger.info(f"⏰ 已清理 {expired_jobs} 个已结束的上传任务")
+    return len(expired)
+
+def _store_sheet(df: pd.DataFrame, filename: str, sheet_name: Optional[str], multiple_sheets: bool) -> Dict[str, Any]:
+    """
+    Stores a parsed sheet under a new file ID and returns its file info with a preview.
+    """
+    # 为每个sheet生成唯一ID
+    file_id = str(uuid.uuid4())
+    logger.info(f"🆔 为工作表 '{sheet_name or filename}' 生成文件ID: {file_id}")
+
+    # 存储数据和元数据
+    metadata = {
+        "original_filename": filename,
+        "sheet_name": sheet_name,
+        "upload_time": pd.Timestamp.now().isoformat(),
+        "version": 1
+    }
+    df = _ingest_dataframe(df, metadata, file_id)
+    data_storage.put(file_id, df, metadata)
+    file_metadata[file_id] = metadata
+
+    return _build_file_info(file_id, df, metadata, multiple_sheets)
+
+def _reuse_upload(upload_key: str, filename: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Registers a re-uploaded file under new file IDs that share the frames of its earlier upload.
+    Returns None when the content was not seen before or its frames are no longer stored.
+    """
+    sheets = upload_index.get(upload_key)
+    if not sheets:
+        return None
+
+    shared_file_ids = []
+    for sheet_name, sheet_hash in sheets:
+        shared_file_id = _find_shared_frame(sheet_hash)
+        if shared_file_id is None:
+            del upload_index[upload_key]
+            return None
+        shared_file_ids.append(shared_file_id)
+
+    logger.info(f"♻️ 文件内容与之前的上传相同，跳过解析: {filename}")
+
+    uploaded_files = []
+    for (sheet_name, sheet_hash), shared_file_id in zip(sheets, shared_file_ids):
+        file_id = str(uuid.uuid4())
+        shared_metadata = file_metadata.get(shared_file_id, {})
+        metadata = {
+            "original_filename": filename,
+            "sheet_name": sheet_name,
+            "upload_time": pd.Timestamp.now().isoformat(),
+            "version": 1,
+            "sheet_hash": sheet_hash,
+            "memory_bytes": shared_metadata.get("memory_bytes", 0),
+            "memory_saved_bytes": shared_metadata.get("memory_saved_bytes", 0),
+            "column_bytes": shared_metadata.get("column_bytes", {}),
+            "rows": shared_metadata.get("rows"),
+            "headers": shared_metadata.get("headers")
+        }
+        df = data_storage[shared_file_id]
+        data_storage.put(file_id, df, metadata)
+        file_metadata[file_id] = metadata
+        shared_frames[sheet_hash].add(file_id)
+        column_catalog[file_id] = _get_column_catalog(shared_file_id, df)
+
+        file_info = _build_file_info(file_id, df, metadata, len(sheets) > 1)
+        file_info["deduplicated"] = True
+        uploaded_files.append(file_info)
+
+    return uploaded_files
+
+def _record_upload(upload_key: str, uploaded_files: List[Dict[str, Any]]):
+    """
+    Remembers the sheet hashes of a parsed upload so identical re-uploads can skip parsing.
+    """
+    sheets = []
+    for file_info in uploaded_files:
+        sheet_hash = file_metadata.get(file_info["file_id"], {}).get("sheet_hash")
+        if sheet_hash is None:
+            return
+        sheets.append((file_info["sheet_name"], sheet_hash))
+
+    if sheets:
+        upload_index[upload_key] = sheets
+
+def _parse_excel_workbook(source, filename: str, job: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Parses every sheet of an Excel workbook into storage and returns the file infos.
+    Sheets of a workbook on disk are parsed concurrently in the process pool;
+    when a job record is given, its sheet and row counters are updated as sheets complete.
+    """
+    # 首先读取所有sheet名称
+    excel_file = pd.ExcelFile(source)
+    sheet_names = excel_file.sheet_names
+    logger.info(f"📋 发现 {len(sheet_names)} 个工作表: {sheet_names}")
+    if job is not None:
+        job["sheets_total"] = len(sheet_names)
+
+    multiple_sheets = len(sheet_names) > 1
+    parsed_files = {}
+
+    def store_parsed_sheet(sheet_name: str, df: pd.DataFrame):
+        logger.info(f"✅ 工作表 '{sheet_name}' 读取成功! 数据形状: {df.shape}")
+        logger.info(f"📊 列名: {df.columns.tolist()}")
+
+        parsed_files[sheet_name] = _store_sheet(df, filename, sheet_name, multiple_sheets)
+        logger.info(f"✅ 工作表 '{sheet_name}' 处理完成")
+
+        if job is not None:
+            job["rows_parsed"] += len(df)
+
+    if multiple_sheets and PARSE_WORKERS > 1 and isinstance(source, str):
+        excel_file.close()
+        logger.info(f"⚙️ 使用 {PARSE_WORKERS} 个进程并行解析 {len(sheet_names)} 个工作表")
+
+        pool = _get_parse_pool()
+        futures = {pool.submit(read_excel_sheet, source, sheet_name): sheet_name for sheet_name in sheet_names}
+
+        # 按完成顺序存储，内存中不会同时积压所有已解析的sheet
+        for future in as_completed(futures):
+            sheet_name = futures[future]
+            try:
+                store_parsed_sheet(sheet_name, future.result())
+            except HTTPException:
+                # 超出内存配额时放弃整个上传
+                for pending in futures:
+                    pending.cancel()
+                raise
+            except Exception as sheet_error:
+                logger.error(f"❌ 处理工作表 '{sheet_name}' 时出错: {str(sheet_error)}")
+
+            if job is not None:
+                job["sheets_done"] += 1
+                _publish_job(job)
+    else:
         # 为每个sheet创建一个独立的文件记录
         for sheet_name in sheet_names:
             try:
                 # 读取特定sheet的数据
-                df = pd.read_excel(excel_file, sheet_name=sheet_name)
-                logger.info(f"✅ 工作表 '{sheet_name}' 读取成功! 数据形状: {df.shape}")
-                logger.info(f"📊 列名: {df.columns.tolist()}")
-
-                # 为每个sheet生成唯一ID
-                file_id = str(uuid.uuid4())
-                logger.info(f"🆔 为工作表 '{sheet_name}' 生成文件ID: {file_id}")
-
-                # 存储数据和元数据
-                data_storage[file_id] = df
-                file_metadata[file_id] = {
-                    "original_filename": file.filename,
-                    "sheet_name": sheet_name,
-                    "upload_time": pd.Timestamp.now().isoformat()
-                }
-
-                # 获取表头
-                headers = df.columns.tolist()
-
-                # 获取预览数据（前5行）
-                preview_df = df.head()
-                preview_data = preview_df.where(pd.notnull(preview_df), None).to_dict(orient='records')
-
-                # 构建文件信息
-                file_info = {
-                    "file_id": file_id,
-                    "filename": f"{file.filename} - {sheet_name}" if len(sheet_names) > 1 else file.filename,
-                    "original_filename": file.filename,
-                    "sheet_name": sheet_name,
-                    "headers": headers,
-                    "preview_data": preview_data,
-                    "rows": len(df),
-                    "columns": len(headers)
-                }
-
-                uploaded_files.append(file_info)
-                logger.info(f"✅ 工作表 '{sheet_name}' 处理完成")
-
+                store_parsed_sheet(sheet_name, pd.read_excel(excel_file, sheet_name=sheet_name))
+            except HTTPException:
+                excel_file.close()
+                raise
             except Exception as sheet_error:
                 logger.error(f"❌ 处理工作表 '{sheet_name}' 时出错: {str(sheet_error)}")
-                continue
 
-        if not uploaded_files:
-            raise HTTPException(status_code=400, detail="No valid sheets found in the Excel file")
+            if job is not None:
+                job["sheets_done"] += 1
+                _publish_job(job)
 
-        logger.info(f"💾 数据已存储到内存，当前存储的文件数量: {len(data_storage)}")
+        excel_file.close()
 
-        # 如果只有一个sheet，返回单个文件格式以保持兼容性
-        if len(uploaded_files) == 1:
-            response_data = uploaded_files[0]
-        else:
-            # 多个sheet时返回文件列表
-            response_data = {
-                "multiple_sheets": True,
-                "files": uploaded_files,
-                "total_sheets": len(uploaded_files)
-            }
+    # 保持工作簿中的sheet顺序
+    return [parsed_files[sheet_name] for sheet_name in sheet_names if sheet_name in parsed_files]
 
-        logger.info(f"✅ 文件上传处理完成: {file.filename}")
-        return response_data
+class _LineCountingReader(io.RawIOBase):
+    """
+    Raw file wrapper that adds the lines read so far to an upload job's rows_parsed, so a CSV
+    parsed in one pass still reports progress.
+    """
+    def __init__(self, raw, job: Dict[str, Any]):
+        self._raw = raw
+        self._job = job
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = self._raw.readinto(buffer)
+        if size:
+            self._job["rows_parsed"] += memoryview(buffer)[:size].tobytes().count(b"\n")
+        return size
+
+def _read_tabular_file(path: str, filename: str, dtypes: Optional[Dict[str, str]] = None,
+                       job: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+    """
+    Reads a CSV, Parquet or Arrow IPC (Feather) file into a DataFrame.
+    CSV is read in one pass using the optional column dtype hints.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+
+    if extension == '.csv':
+        # 整个文件统一推断列类型；分块读取（包括low_memory的内部分块）时各块单独推断，同一列会混入不同类型
+        if job is None:
+            return pd.read_csv(path, dtype=dtypes, low_memory=False)
+        rows_before = job["rows_parsed"]
+        with open(path, 'rb', buffering=0) as raw:
+            df = pd.read_csv(_LineCountingReader(raw, job), dtype=dtypes, low_memory=False)
+        # 按行计数包含表头和引号内的换行，读取完成后改为实际行数
+        job["rows_parsed"] = rows_before + len(df)
+        return df
+
+    if extension == '.parquet':
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_feather(path)
+
+    if job is not None:
+        job["rows_parsed"] += len(df)
+    return df
+
+def _parse_upload(path: str, filename: str, dtypes: Optional[Dict[str, str]] = None,
+                  job: Optional[Dict[str, Any]] = None, upload_key: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Parses a spooled upload into storage according to its file type and returns the file infos.
+    An upload whose content key matches an earlier upload reuses its stored frames without parsing.
+    """
+    if upload_key is not None:
+        uploaded_files = _reuse_upload(upload_key, filename)
+        if uploaded_files is not None:
+            if job is not None:
+                job["sheets_total"] = job["sheets_done"] = len(uploaded_files)
+                job["rows_parsed"] = sum(info["rows"] for info in uploaded_files)
+            return uploaded_files
+
+    if filename.lower().endswith(EXCEL_EXTENSIONS):
+        uploaded_files = _parse_excel_workbook(path, filename, job)
+    else:
+        if job is not None:
+            job["sheets_total"] = 1
+
+        df = _read_tabular_file(path, filename, dtypes, job)
+        logger.info(f"✅ 文件 '{filename}' 读取成功! 数据形状: {df.shape}")
+        logger.info(f"📊 列名: {df.columns.tolist()}")
+
+        if job is not None:
+            job["sheets_done"] = 1
+
+        uploaded_files = [_store_sheet(df, filename, None, False)]
+
+    if upload_key is not None:
+        _record_upload(upload_key, uploaded_files)
+    return uploaded_files
+
+def _upload_key(content_hash: str, dtypes: Optional[Dict[str, str]]) -> str:
+    """
+    Returns the deduplication key of an upload: its content hash plus any parse options that change the result.
+    """
+    if not dtypes:
+        return content_hash
+    return f"{content_hash}:{json.dumps(dtypes, sort_keys=True)}"
+
+def _build_upload_response(uploaded_files: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Builds the upload response: a single file info, or a file list for multi-sheet workbooks.
+    """
+    # 如果只有一个sheet，返回单个文件格式以保持兼容性
+    if len(uploaded_files) == 1:
+        return uploaded_files[0]
+
+    # 多个sheet时返回文件列表
+    return {
+        "multiple_sheets": True,
+        "files": uploaded_files,
+        "total_sheets": len(uploaded_files)
+    }
+
+async def _spool_upload(file: UploadFile, job: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
+    """
+    Copies the uploaded body to a file in the spool directory chunk by chunk.
+    Returns the spooled path and the SHA-256 of the content.
+    """
+    digest = hashlib.sha256()
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    suffix = os.path.splitext(file.filename)[1]
+    fd, spool_path = tempfile.mkstemp(suffix=suffix, dir=UPLOAD_SPOOL_DIR)
+
+    try:
+        with os.fdopen(fd, "wb") as spool_file:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                spool_file.write(chunk)
+                digest.update(chunk)
+                if job is not None:
+                    job["bytes_read"] += len(chunk)
+    except Exception:
+        os.remove(spool_path)
+        raise
+
+    return spool_path, digest.hexdigest()
+
+def _run_upload_job(job_id: str, spool_path: str, dtypes: Optional[Dict[str, str]] = None,
+                    upload_key: Optional[str] = None, ttl_seconds: Optional[float] = None,
+                    idle_ttl_seconds: Optional[float] = None):
+    """
+    Background task: parses a spooled upload and records the result on its job.
+    """
+    job = upload_jobs[job_id]
+    job["status"] = "parsing"
+    _publish_job(job)
+    logger.info(f"🔄 [任务 {job_id[:8]}] 开始后台解析: {job['filename']}")
+
+    try:
+        uploaded_files = _parse_upload(spool_path, job["filename"], dtypes, job, upload_key)
+        if not uploaded_files:
+            raise ValueError("No valid sheets found in the uploaded file")
+
+        job["result"] = _build_upload_response(uploaded_files)
+        job["file_ids"] = [info["file_id"] for info in uploaded_files]
+        _apply_ttl_policy(job["file_ids"], ttl_seconds, idle_ttl_seconds)
+        job["status"] = "completed"
+        logger.info(f"✅ [任务 {job_id[:8]}] 后台解析完成: {len(uploaded_files)} 个工作表, {job['rows_parsed']} 行")
 
     except Exception as e:
-        logger.error(f"❌ Excel文件处理失败: {str(e)}")
-        raise HTTPException(status_code=400, detail=f"Error processing Excel file: {e}")
+        job["status"] = "failed"
+        job["error"] = str(e)
+        logger.error(f"❌ [任务 {job_id[:8]}] 后台解析失败: {str(e)}")
 
-@app.post("/api/filter")
-async def filter_data(payload: FilterPayload):
+    finally:
+        job["finished_time"] = pd.Timestamp.now().isoformat()
+        _publish_job(job)
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+
+@app.post("/api/upload")
+async def upload_excel_file(
+    background_tasks: BackgroundTasks,
+    response: Response,
+    file: UploadFile = File(...),
+    mode: str = Query("sync", description="'sync' parses in the request; 'background' returns a job ID to poll; "
+                                          "'lazy' registers .xlsx sheets and parses each on first access; "
+                                          "'preview' returns the first rows and loads .xlsx sheets in the background"),
+    dtypes: Optional[str] = Form(None, description="JSON object of column -> dtype hints for CSV uploads"),
+    ttl_seconds: Optional[float] = Query(None, description="Remove the uploaded files this long after the upload"),
+    idle_ttl_seconds: Optional[float] = Query(None, description="Remove the uploaded files once unused for this long"),
+    format: Optional[str] = Query(None, description="'records' (default) or 'columnar' preview_data"),
+    accept: Optional[str] = Header(None),
+):
     """
-    Filters the dataframe based on the provided criteria.
+    Handles the upload of an Excel, CSV, Parquet or Arrow/Feather file, processes it, and returns a preview.
+    Supports multiple sheets and returns information about all sheets.
+    With mode=background the body is spooled to disk and parsed after the response;
+    poll /api/upload/status/{job_id} for progress and the final result.
+    With mode=lazy the sheets of an .xlsx workbook are only registered (headers and
+    dimensions, no preview rows) and each is parsed the first time it is read.
+    With mode=preview only the header and first rows of each .xlsx sheet are read before
+    responding; the full sheets load in the background and data endpoints answer 503
+    while a sheet is still loading.
+    With the columnar format, each preview_data is {"columns", "data"} instead of a list of rows.
     """
-    logger.info(f"🔍 [后端] 开始数据筛选，文件ID: {payload.file_id}")
-    logger.info(f"🔍 [后端] 筛选条件: {payload.filters}")
+    logger.info(f"📁 收到文件上传请求: {file.filename}")
+    logger.info(f"📊 文件大小: {file.size if hasattr(file, 'size') else '未知'} bytes")
+    logger.info(f"📋 文件类型: {file.content_type}")
 
-    df = data_storage.get(payload.file_id)
-    if df is None:
-        raise HTTPException(status_code=404, detail="File ID not found.")
+    # Check if the file is a supported type
+    if not file.filename.lower().endswith(EXCEL_EXTENSIONS + TABULAR_EXTENSIONS):
+        logger.error(f"❌ 无效文件类型: {file.filename}")
+        raise HTTPException(status_code=400, detail="Invalid file type. Please upload an Excel, CSV, Parquet or Arrow/Feather file.")
+
+    dtype_hints = None
+    if dtypes:
+        try:
+            dtype_hints = json.loads(dtypes)
+        except ValueError:
+            dtype_hints = None
+        if not isinstance(dtype_hints, dict):
+            raise HTTPException(status_code=400, detail="Invalid dtypes format. Expected a JSON object of column -> dtype.")
+
+    columnar = _negotiate_format(accept, format, ("records", "columnar")) == "columnar"
+
+    if mode not in ("sync", "background", "lazy", "preview"):
+        raise HTTPException(status_code=400, detail=f"Invalid upload mode '{mode}'. Use 'sync', 'background', 'lazy' or 'preview'.")
+
+    if mode == "background":
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "status": "spooling",
+            "filename": file.filename,
+            "bytes_total": file.size,
+            "bytes_read": 0,
+            "sheets_total": None,
+            "sheets_done": 0,
+            "rows_parsed": 0,
+            "file_ids": [],
+            "result": None,
+            "error": None,
+            "created_time": pd.Timestamp.now().isoformat(),
+            "finished_time": None
+        }
+        upload_jobs[job_id] = job
+
+        try:
+            spool_path, content_hash = await _spool_upload(file, job)
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+            job["finished_time"] = pd.Timestamp.now().isoformat()
+            _publish_job(job)
+            logger.error(f"❌ 上传文件落盘失败: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error spooling upload: {e}")
+
+        job["status"] = "queued"
+        _publish_job(job)
+        background_tasks.add_task(_run_upload_job, job_id, spool_path, dtype_hints, _upload_key(content_hash, dtype_hints),
+                                  ttl_seconds, idle_ttl_seconds)
+        logger.info(f"📥 文件已落盘，后台任务已创建: {job_id} ({job['bytes_read']} bytes)")
 
-    logger.info(f"📊 [后端] 原始数据形状: {df.shape}")
-    logger.info(f"📊 [后端] 数据列名: {df.columns.tolist()}")
+        return {
+            "job_id": job_id,
+            "status": job["status"],
+            "status_url": f"/api/upload/status/{job_id}"
+        }
 
-    filtered_df = df.copy()
+    try:
+        logger.info("🔄 开始读取文件...")
+
+        # 落盘后各工作进程可以直接按路径打开工作簿
+        spool_path, content_hash = await _spool_upload(file)
+        upload_key = _upload_key(content_hash, dtype_hints)
+        # 延迟模式只适用于.xlsx，落盘文件保留到所有sheet解析完成；重复上传直接共享已有数据
+        # 多worker共享存储时落盘文件和解析锁只属于当前进程，延迟模式退回为立即解析
+        reused_files = _reuse_upload(upload_key, file.filename)
+        lazy = (reused_files is None and mode in ("lazy", "preview") and not SHARED_STORE
+                and file.filename.lower().endswith('.xlsx'))
+        try:
+            if reused_files is not None:
+                uploaded_files = reused_files
+            elif lazy:
+                preview_rows = PREVIEW_ROWS if mode == "preview" else 0
+                uploaded_files = _register_lazy_workbook(spool_path, file.filename, preview_rows)
+                if mode == "preview":
+                    background_tasks.add_task(_load_pending_sheets, [info["file_id"] for info in uploaded_files])
+            else:
+                uploaded_files = _parse_upload(spool_path, file.filename, dtype_hints, upload_key=upload_key)
+        finally:
+            if not lazy or spool_path not in lazy_sources:
+                os.remove(spool_path)
 
-    for column, values in payload.filters.items():
-        if column in filtered_df.columns:
-            if values: # Ensure there are values to filter by
-                logger.info(f"🔍 [后端] 筛选列 '{column}', 筛选值: {values} (类型: {[type(v).__name__ for v in values]})")
+        if not uploaded_files:
+            raise HTTPException(status_code=400, detail="No valid sheets found in the uploaded file")
 
-                # 检查数据列的实际数据类型
-                sample_data = filtered_df[column].dropna().head(5).tolist()
-                logger.info(f"📊 [后端] 列 '{column}' 样本数据: {sample_data} (类型: {[type(v).__name__ for v in sample_data]})")
+        _apply_ttl_policy([info["file_id"] for info in uploaded_files], ttl_seconds, idle_ttl_seconds)
+        logger.info(f"💾 数据已存储到内存，当前存储的文件数量: {len(_stored_file_ids())}")
 
-                # 尝试数据类型转换匹配
-                original_count = len(filtered_df)
+        if columnar:
+            # 预览只有前几行，仍交给jsonable_encoder处理日期等类型
+            response_data = _build_upload_response([_columnar_preview(info) for info in uploaded_files])
+            logger.info(f"✅ 文件上传处理完成: {file.filename}")
+            return _columnar_response(jsonable_encoder(response_data))
 
-                # 方法1: 直接匹配
-                mask1 = filtered_df[column].isin(values)
-                count1 = mask1.sum()
+        response_data = _build_upload_response(uploaded_files)
+        response.headers["Vary"] = "Accept"
+
+        logger.info(f"✅ 文件上传处理完成: {file.filename}")
+        return response_data
+
+    except HTTPException as e:
+        if e.status_code in (413, 507):
+            raise
+        logger.error(f"❌ 文件处理失败: {e.detail}")
+        raise HTTPException(status_code=400, detail=f"Error processing uploaded file: {e}")
+    except Exception as e:
+        logger.error(f"❌ 文件处理失败: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Error processing uploaded file: {e}")
+
+@app.get("/api/upload/status/{job_id}")
+def get_upload_status(job_id: str):
+    """
+    Returns the progress of a background upload job, and its upload response once completed.
+    """
+    # 任务可能由其他worker进程处理
+    job = upload_jobs.get(job_id) or data_storage.load_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Upload job not found.")
+
+    return job
+
+@app.post("/api/filter")
+async def filter_data(
+    payload: FilterPayload,
+    accept: Optional[str] = Header(None),
+    format: Optional[str] = Query(None, description="'records' (default), 'columnar', 'arrow', 'float64' or 'ndjson'"),
+):
+    """
+    Filters the dataframe based on the provided criteria.
+    A `where` expression tree is ANDed with the per-column value filters.
+    With columns, only those columns are gathered and returned.
+    With offset/limit or a cursor, returns one page of at most MAX_PAGE_ROWS rows as
+    {"rows", "total", "offset", "limit", "next_cursor"}; otherwise returns all rows as a list.
+    With the columnar format (Accept: application/vnd.daplot.columnar+json or format=columnar),
+    rows are returned as {"columns", "data"} instead. The arrow and float64 formats return the
+    rows as an Arrow IPC stream or as Float64 column buffers, with paging in the X-* headers.
+    The ndjson format streams one JSON object per row in batches.
+    """
+    log = SampledLogger(logger, "filter")
+    response_format = _negotiate_format(accept, format)
+    columnar = response_format == "columnar"
+    log.info("🔍 [后端] 开始数据筛选，文件ID: %s", payload.file_id)
+    log.debug("🔍 [后端] 筛选条件: %s", payload.filters)
+
+    df = await _load_dataframe(payload.file_id)
+
+    log.info("📊 [后端] 原始数据形状: %s", df.shape)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("📊 [后端] 数据列名: %s", df.columns.tolist())
+
+    catalog = _get_column_catalog(payload.file_id, df)
+    # 当前候选行：None表示全部行，否则为压缩位图或升序行位置；不复制DataFrame
+    candidates = None
+
+    # 只收集和序列化请求的列
+    projected_df = _project_columns(df, payload.columns)
+
+    # 相同的筛选条件直接使用缓存的行位置
+    projection = tuple(projected_df.columns) if payload.columns else None
+    cache_key = _filter_cache_key(payload.file_id, "filter", payload.filters, projection, payload.where)
+    cacheable = cache_key[3] and all(column in df.columns for column in payload.filters)
+    cached_rows = filter_cache.get(cache_key) if cacheable else None
+    if cached_rows is not None:
+        log.info("⚡ [后端] 筛选结果缓存命中: %d 行", len(cached_rows))
+        candidates = cached_rows
+
+    for column, values in (payload.filters.items() if cached_rows is None else ()):
+        if column in df.columns:
+            if values: # Ensure there are values to filter by
+                stats = catalog[column]
+                index = _get_column_index(payload.file_id, column, stats)
+                column_values = df[column]
+                # 样本数据和类型列表只在DEBUG级别计算
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("🔍 [后端] 筛选列 '%s', 筛选值: %s (类型: %s)", column, values, [type(v).__name__ for v in values])
+
+                    # 检查数据列的实际数据类型（位图候选只取前8192行中的样本）
+                    if candidates is None:
+                        sample_rows = column_values.head(50)
+                    elif candidates.dtype == np.uint8:
+                        sample_rows = column_values.iloc[_candidate_positions(candidates[:1024], min(len(df), 8192))[:50]]
+                    else:
+                        sample_rows = column_values.iloc[candidates[:50]]
+                    sample_data = sample_rows.dropna().head(5).tolist()
+                    log.debug("📊 [后端] 列 '%s' 样本数据: %s (类型: %s)", column, sample_data, [type(v).__name__ for v in sample_data])
+
+                # 方法1: 直接匹配；数值列与字符串筛选值不可能直接相等，跳过
+                if stats["numeric"]:
+                    rows1 = np.empty(0, dtype=np.intp)
+                else:
+                    rows1 = _match_rows(index, "direct", column_values, values, candidates)
+                count1 = _candidate_count(rows1)
 
                 # 方法2: 转换为字符串后匹配
                 str_values = [str(v) for v in values]
-                mask2 = filtered_df[column].astype(str).isin(str_values)
-                count2 = mask2.sum()
+                rows2 = _match_rows(index, "string", column_values, str_values, candidates)
+                count2 = _candidate_count(rows2)
 
                 # 方法3: 尝试将数据列转换为数字后匹配
-                try:
-                    numeric_column = pd.to_numeric(filtered_df[column], errors='coerce')
-                    numeric_values = []
-                    for v in values:
-                        try:
-                            numeric_values.append(float(v))
-                        except (ValueError, TypeError):
-                            numeric_values.append(v)
-                    mask3 = numeric_column.isin(numeric_values)
-                    count3 = mask3.sum()
-                except:
-                    count3 = 0
-                    mask3 = pd.Series([False] * len(filtered_df))
-
-                logger.info(f"🔍 [后端] 匹配结果 - 直接匹配: {count1}, 字符串匹配: {count2}, 数字匹配: {count3}")
+                numeric_values = []
+                for v in values:
+                    try:
+                        numeric_values.append(float(v))
+                    except (ValueError, TypeError):
+                        numeric_values.append(v)
+                # 列中没有可转换为数字的值时只有NaN筛选值可能匹配，否则跳过转换
+                if stats["numeric_count"] == 0 and not any(v != v for v in numeric_values):
+                    rows3 = np.empty(0, dtype=np.intp)
+                else:
+                    try:
+                        rows3 = _match_rows(index, "numeric", column_values, numeric_values, candidates)
+                    except Exception:
+                        rows3 = np.empty(0, dtype=np.intp)
+                count3 = _candidate_count(rows3)
+
+                log.debug("🔍 [后端] 匹配结果 - 直接匹配: %d, 字符串匹配: %d, 数字匹配: %d", count1, count2, count3)
 
                 # 选择匹配数量最多的方法
                 if count3 > 0 and count3 >= max(count1, count2):
-                    filtered_df = filtered_df[mask3]
-                    logger.info(f"✅ [后端] 使用数字匹配，筛选后数据行数: {len(filtered_df)}")
+                    candidates = rows3
+                    log.info("✅ [后端] 列 '%s' 使用数字匹配，筛选后数据行数: %d", column, count3)
                 elif count2 > 0 and count2 >= count1:
-                    filtered_df = filtered_df[mask2]
-                    logger.info(f"✅ [后端] 使用字符串匹配，筛选后数据行数: {len(filtered_df)}")
+                    candidates = rows2
+                    log.info("✅ [后端] 列 '%s' 使用字符串匹配，筛选后数据行数: %d", column, count2)
                 else:
-                    filtered_df = filtered_df[mask1]
-                    logger.info(f"✅ [后端] 使用直接匹配，筛选后数据行数: {len(filtered_df)}")
+                    candidates = rows1
+                    log.info("✅ [后端] 列 '%s' 使用直接匹配，筛选后数据行数: %d", column, count1)
 
         else:
             # Optionally, raise an error if the column doesn't exist
-            logger.error(f"❌ [后端] 筛选列 '{column}' 在数据中不存在")
+            log.error("❌ [后端] 筛选列 '%s' 在数据中不存在", column)
             raise HTTPException(status_code=400, detail=f"Filter column '{column}' not found in data.")
 
-    logger.info(f"✅ [后端] 数据筛选完成，最终数据行数: {len(filtered_df)}")
-
-    # Convert NaN to None for JSON compatibility and return as records
-    result = filtered_df.where(pd.notnull(filtered_df), None).to_dict(orient='records')
-    logger.info(f"📤 [后端] 返回筛选结果: {len(result)} 行数据")
-
-    return result
+    # 只在最后按行位置收集一次
+    if cached_rows is None and (candidates is not None or payload.where is not None):
+        if candidates is not None:
+            candidates = _candidate_positions(candidates, len(df))
+        candidates = _apply_expression(payload.file_id, df, payload.where, candidates)
+        filter_cache.put(cache_key, candidates)
+    total = len(df) if candidates is None else len(candidates)
+    log.info("✅ [后端] 数据筛选完成，最终数据行数: %d", total, extra={"rows": total})
+
+    if payload.offset is not None or payload.limit is not None or payload.cursor is not None:
+        # 游标绑定文件版本和筛选条件
+        query = hashlib.sha256(repr(cache_key[2:]).encode()).hexdigest()[:16]
+        page = _resolve_page(payload.file_id, cache_key[1], query, total,
+                             payload.offset, payload.limit, payload.cursor)
+        # 先截取本页的行位置，只收集本页的行
+        if candidates is None:
+            page_df = projected_df.iloc[page["start"]:page["stop"]]
+        else:
+            page_df = projected_df.iloc[candidates[page["start"]:page["stop"]]]
+        log.info("📤 [后端] 返回筛选结果第 %d-%d 行，共 %d 行", page["start"], page["stop"], page["total"])
+        page_info = {
+            "total": page["total"],
+            "offset": page["offset"],
+            "limit": page["limit"],
+            "next_cursor": page["next_cursor"]
+        }
+        if response_format == "ndjson":
+            return _ndjson_response(page_df, _page_headers(page))
+        if response_format in ("arrow", "float64"):
+            return _binary_response(page_df, response_format, _page_headers(page))
+        if columnar:
+            return _columnar_response({**_to_columns(page_df), **page_info})
+        return _raw_json_response(page_info, {"rows": _records_json(page_df)}, headers={"Vary": "Accept"})
+
+    if response_format == "ndjson":
+        # 按行位置逐批收集，不复制全部筛选结果
+        log.info("📤 [后端] 流式返回筛选结果: %d 行数据", total)
+        return _ndjson_response(projected_df, {}, rows=candidates)
+
+    filtered_df = projected_df if candidates is None else projected_df.iloc[candidates]
+    if response_format in ("arrow", "float64"):
+        log.info("📤 [后端] 返回二进制筛选结果: %d 行数据", len(filtered_df))
+        return _binary_response(filtered_df, response_format, {})
+    if columnar:
+        log.info("📤 [后端] 返回列式筛选结果: %d 行数据", len(filtered_df))
+        return _columnar_response(_to_columns(filtered_df))
+
+    # 直接按列编码为JSON字节，NaN/NaT为null
+    log.info("📤 [后端] 返回筛选结果: %d 行数据", len(filtered_df))
+    return Response(content=_records_json(filtered_df).encode("utf-8"), media_type="application/json",
+                    headers={"Vary": "Accept"})
 
 @app.get("/api/file/{file_id}")
-async def get_file_data(file_id: str):
+async def get_file_data(
+    file_id: str,
+    version: Optional[int] = Query(None, description="Earlier version to read, if still retained"),
+    offset: Optional[int] = Query(None, description="First row of the page to return"),
+    limit: Optional[int] = Query(None, description="Maximum rows of the page, capped at the server page size"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    columns: Optional[List[str]] = Query(None, description="Columns to return; repeat the parameter for several"),
+    format: Optional[str] = Query(None, description="'records' (default), 'columnar', 'arrow', 'float64' or 'ndjson'"),
+    if_none_match: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None),
+):
     """
     Retrieves the complete data for a specific file ID.
+    With offset/limit or a cursor, preview_data holds one page of at most MAX_PAGE_ROWS rows,
+    and total_rows and next_cursor describe the rest. With columns, only those columns are returned.
+    With the columnar format, preview_data is {"columns", "data"} instead of a list of rows.
+    The arrow, float64 and ndjson formats return only the rows, as in /api/filter.
+    The ETag identifies the file version and the format, columns and page of the response;
+    a matching If-None-Match returns 304.
     """
-    logger.info(f"📁 请求获取文件数据: {file_id}")
-
-    df = data_storage.get(file_id)
-    if df is None:
-        logger.error(f"❌ 文件ID未找到: {file_id}")
-        raise HTTPException(status_code=404, detail="File ID not found.")
+    log = SampledLogger(logger, "file")
+    log.info("📁 请求获取文件数据: %s", file_id)
+
+    df = await _load_dataframe(file_id)
+    current_version = _dataset_version(file_id)
+    if version is not None and version != current_version:
+        retained = dataset_versions.get((file_id, version))
+        if retained is None:
+            raise HTTPException(status_code=404, detail=f"Version {version} of this file is not available.")
+        df = retained["df"]
+    else:
+        version = current_version
 
     # Get headers
+    df = _project_columns(df, columns)
     headers = df.columns.tolist()
 
+    page = None
+    if offset is not None or limit is not None or cursor is not None:
+        query = hashlib.sha256(repr(headers).encode()).hexdigest()[:16] if columns else ""
+        page = _resolve_page(file_id, version, query, len(df), offset, limit, cursor)
+        df = df.iloc[page["start"]:page["stop"]]
+
+    # 同一URL的不同格式、列和分页是不同的表示，ETag各不相同
+    response_format = _negotiate_format(accept, format)
+    etag = _representation_etag(file_id, version, response_format, headers if columns else None, page)
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept"})
+
+    if response_format == "ndjson":
+        log.info("✅ 开始流式返回文件数据: %d行 × %d列", len(df), len(headers))
+        return _ndjson_response(df, {"ETag": etag, **(_page_headers(page) if page else {})})
+    if response_format in ("arrow", "float64"):
+        log.info("✅ 文件数据获取成功(二进制): %d行 × %d列", len(df), len(headers))
+        return _binary_response(df, response_format, {"ETag": etag, **(_page_headers(page) if page else {})})
+
     # Get all data (convert NaN to None for JSON compatibility)
-    all_data = df.where(pd.notnull(df), None).to_dict(orient='records')
+    columnar = response_format == "columnar"
+    all_data = _to_columns(df) if columnar else _records_json(df)
 
-    logger.info(f"✅ 文件数据获取成功: {len(all_data)}行 × {len(headers)}列")
+    log.info("✅ 文件数据获取成功: %d行 × %d列", len(df), len(headers))
 
-    return {
+    result = {
         "file_id": file_id,
         "filename": f"file_{file_id[:8]}.xlsx",  # Generate a filename since we don't store original names
         "headers": headers,
+        "version": version,
         "preview_data": all_data  # Return all data for editing
     }
+    if page is not None:
+        result.update(total_rows=page["total"], offset=page["offset"], limit=page["limit"], next_cursor=page["next_cursor"])
+    if columnar:
+        return _columnar_response(result, headers={"ETag": etag})
+    return _raw_json_response({key: value for key, value in result.items() if key != "preview_data"},
+                              {"preview_data": all_data}, headers={"ETag": etag, "Vary": "Accept"})
 
 @app.post("/api/plot_data")
-async def get_plot_data(payload: PlotDataPayload):
+async def get_plot_data(
+    payload: PlotDataPayload,
+    response: Response,
+    accept: Optional[str] = Header(None),
+    format: Optional[str] = Query(None, description="'records' (default), 'arrow' or 'float64'"),
+):
     """
     Prepares data for plotting by filtering and extracting x and y axis values.
+    The arrow format returns an Arrow IPC stream with columns x and y; the float64 format returns
+    the x buffer followed by the y buffer. X-Plot-Labels holds the axis labels of both.
     """
-    df = data_storage.get(payload.file_id)
-    if df is None:
-        raise HTTPException(status_code=404, detail="File ID not found.")
+    response_format = _negotiate_format(accept, format, ("records", "arrow", "float64"))
+    df = await _load_dataframe(payload.file_id)
 
     # Apply filters first
-    filtered_df = df.copy()
-    for column, values in payload.filters.items():
-        if column in filtered_df.columns:
-            if values:  # Ensure there are values to filter by
-                filtered_df = filtered_df[filtered_df[column].isin(values)]
-        else:
-            raise HTTPException(status_code=400, detail=f"Filter column '{column}' not found in data.")
+    rows = _filter_rows(payload.file_id, df, payload.filters, projection=(payload.x_axis, payload.y_axis),
+                        expression=payload.where)
 
     # Check if x_axis and y_axis columns exist
-    if payload.x_axis not in filtered_df.columns:
+    if payload.x_axis not in df.columns:
         raise HTTPException(status_code=400, detail=f"X-axis column '{payload.x_axis}' not found in data.")
-    if payload.y_axis not in filtered_df.columns:
+    if payload.y_axis not in df.columns:
         raise HTTPException(status_code=400, detail=f"Y-axis column '{payload.y_axis}' not found in data.")
 
-    # Extract x and y values, removing any NaN values
-    x_values = filtered_df[payload.x_axis].dropna().tolist()
-    y_values = filtered_df[payload.y_axis].dropna().tolist()
+    # Extract x and y values, removing any NaN values (skipped for columns the catalog shows have none)
+    catalog = _get_column_catalog(payload.file_id, df)
+    x_column = df[payload.x_axis] if rows is None else df[payload.x_axis].iloc[rows]
+    y_column = df[payload.y_axis] if rows is None else df[payload.y_axis].iloc[rows]
+    x_column = x_column if catalog[payload.x_axis]["null_count"] == 0 else x_column.dropna()
+    y_column = y_column if catalog[payload.y_axis]["null_count"] == 0 else y_column.dropna()
+
+    if response_format in ("arrow", "float64"):
+        # 直接发送列缓冲区，不逐值转换为Python对象
+        min_length = min(len(x_column), len(y_column))
+        points = pd.DataFrame({"x": x_column.iloc[:min_length].reset_index(drop=True),
+                               "y": y_column.iloc[:min_length].reset_index(drop=True)})
+        return _binary_response(points, response_format,
+                                {"X-Plot-Labels": json.dumps([str(payload.x_axis), str(payload.y_axis)])})
+
+    x_values = x_column.tolist()
+    y_values = y_column.tolist()
+    response.headers["Vary"] = "Accept"
 
     # Ensure both lists have the same length by taking the minimum length
     min_length = min(len(x_values), len(y_values))
@@ -328,11 +2994,12 @@ async def get_plot_data(payload: PlotDataPayload):
     }
 
 @app.post("/api/save")
-async def save_file_data(payload: SaveFilePayload):
+async def save_file_data(payload: SaveFilePayload, response: Response):
     """
     Saves updated file data back to storage.
     """
-    logger.info(f"📁 请求保存文件数据: {payload.file_id}")
+    log = SampledLogger(logger, "save")
+    log.info("📁 请求保存文件数据: %s", payload.file_id)
 
     try:
         # 验证数据格式
@@ -344,22 +3011,64 @@ async def save_file_data(payload: SaveFilePayload):
 
         # 创建DataFrame
         df = pd.DataFrame(payload.data, columns=payload.headers)
-
-        # 更新存储
-        data_storage[payload.file_id] = df
-
-        logger.info(f"✅ 文件数据保存成功: {payload.file_id}, 数据形状: {df.shape}")
-
+        _sync_shared_file(payload.file_id)
+
+        # 保存生成新的不可变版本，未修改的列与上一版本共享；正在读取上一版本的请求不受影响
+        metadata = file_metadata.get(payload.file_id)
+        previous = data_storage.get(payload.file_id)
+        df, changed = _build_saved_frame(previous, df)
+        memory_bytes = int(df.memory_usage(deep=True).sum())
+        replacing = data_storage.frame_info(payload.file_id)
+        _check_memory_quota(memory_bytes, replacing["bytes"] if replacing and len(replacing["keys"]) == 1 else 0)
+        if metadata is None:
+            # 通过保存新建的文件同样登记元数据，之后每次保存版本递增
+            metadata = file_metadata[payload.file_id] = {
+                "original_filename": f"file_{payload.file_id[:8]}.xlsx",
+                "sheet_name": None,
+                "upload_time": pd.Timestamp.now().isoformat(),
+                "version": 0 if previous is None else 1
+            }
+        version = metadata.get("version", 1)
+        if previous is not None:
+            _retain_version(payload.file_id, version, previous, changed)
+        metadata["version"] = version + 1
+
+        # 更新存储；尚未解析的延迟sheet不再需要解析，共享的原数据不再被此文件引用
+        _release_frame(payload.file_id, metadata)
+        metadata["rows"] = len(df)
+        metadata["headers"] = df.columns.tolist()
+        metadata["memory_bytes"] = memory_bytes
+        metadata["column_bytes"] = _column_bytes(df)
+        if metadata.get("source_path"):
+            _release_lazy_source(payload.file_id, metadata["source_path"])
+            metadata["source_path"] = None
+            metadata["status"] = "ready"
+        # 数据和元数据在同一次索引写入中替换
+        data_storage.put(payload.file_id, df, metadata)
+        column_catalog[payload.file_id] = _build_column_catalog(df)
+        filter_indexes.pop(payload.file_id, None)
+        filter_cache.invalidate(payload.file_id)
+        _record_access(payload.file_id)
+
+        version = _dataset_version(payload.file_id)
+        log.info("✅ 文件数据保存成功: %s, 数据形状: %s, 版本: %d, 修改列: %d/%d",
+                 payload.file_id, df.shape, version, len(changed), len(payload.headers))
+
+        response.headers["ETag"] = _dataset_etag(payload.file_id, version)
         return {
             "success": True,
             "message": "File data saved successfully",
             "file_id": payload.file_id,
             "rows": len(payload.data),
-            "columns": len(payload.headers)
+            "columns": len(payload.headers),
+            "version": version,
+            "changed_columns": changed
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"❌ 保存文件数据失败: {str(e)}")
+        log.error("❌ 保存文件数据失败: %s", e)
         raise HTTPException(status_code=500, detail=f"Error saving file data: {e}")
 
 @app.get("/api/files")
@@ -367,10 +3076,12 @@ def list_files():
     """
     Returns a list of all stored files with their metadata.
     """
-    logger.info(f"📋 获取文件列表请求，当前存储文件数: {len(data_storage)}")
+    _sync_shared_files()
+    file_ids = _stored_file_ids()
+    logger.info(f"📋 获取文件列表请求，当前存储文件数: {len(file_ids)}")
 
     files_info = []
-    for file_id, df in data_storage.items():
+    for file_id in file_ids:
         # 获取文件元数据
         metadata = file_metadata.get(file_id, {})
         original_filename = metadata.get("original_filename", f"file_{file_id[:8]}.xlsx")
@@ -382,15 +3093,22 @@ def list_files():
         else:
             display_filename = original_filename
 
+        # 未驻留内存（延迟解析或已溢出到磁盘）的数据使用元数据中记录的尺寸，避免为列表重新加载
+        df = data_storage.peek(file_id)
+        headers = df.columns.tolist() if df is not None else metadata.get("headers", [])
+
         file_info = {
             "file_id": file_id,
             "filename": display_filename,
             "original_filename": original_filename,
             "sheet_name": sheet_name,
-            "rows": len(df),
-            "columns": len(df.columns),
-            "headers": df.columns.tolist(),
-            "upload_time": metadata.get("upload_time")
+            "rows": len(df) if df is not None else metadata.get("rows"),
+            "columns": len(headers),
+            "headers": headers,
+            "upload_time": metadata.get("upload_time"),
+            "memory_bytes": metadata.get("memory_bytes"),
+            "version": metadata.get("version", 1),
+            "status": metadata.get("status", "ready")
         }
         files_info.append(file_info)
 
@@ -403,15 +3121,14 @@ async def delete_file_data(file_id: str):
     Deletes a file from storage.
     """
     logger.info(f"🗑️ 请求删除文件: {file_id}")
+    _sync_shared_file(file_id)
 
-    if file_id not in data_storage:
+    if file_id not in data_storage and file_id not in file_metadata:
         logger.error(f"❌ 文件ID未找到: {file_id}")
         raise HTTPException(status_code=404, detail="File ID not found.")
 
     # 删除数据和元数据
-    del data_storage[file_id]
-    if file_id in file_metadata:
-        del file_metadata[file_id]
+    _remove_file(file_id)
 
     logger.info(f"✅ 文件删除成功: {file_id}")
 
@@ -428,11 +3145,25 @@ async def clear_all_files():
     """
     logger.info("🗑️ 请求清空所有文件")
 
-    file_count = len(data_storage)
+    file_count = len(_stored_file_ids())
 
-    # 清空所有存储
+    # 清空所有存储，并移除尚未解析的工作簿落盘文件
     data_storage.clear()
     file_metadata.clear()
+    shared_frames.clear()
+    upload_index.clear()
+    column_catalog.clear()
+    filter_indexes.clear()
+    filter_cache.invalidate()
+    last_access.clear()
+    _published_access.clear()
+    _drop_versions()
+    for source_path in list(lazy_sources):
+        if os.path.exists(source_path):
+            os.remove(source_path)
+    lazy_sources.clear()
+    # 已结束的上传任务引用的文件都已删除，进行中的任务保留以便继续查询进度
+    _remove_finished_jobs()
 
     logger.info(f"✅ 已清空所有文件，共删除 {file_count} 个文件")
 
@@ -447,21 +3178,21 @@ async def get_unique_values(file_id: str, column_name: str):
     """
     Returns unique values for a specific column in a file.
     """
-    logger.info(f"🔍 请求获取唯一值: 文件ID={file_id}, 列名={column_name}")
+    log = SampledLogger(logger, "unique_values")
+    log.info("🔍 请求获取唯一值: 文件ID=%s, 列名=%s", file_id, column_name)
 
-    df = data_storage.get(file_id)
-    if df is None:
-        logger.error(f"❌ 文件ID未找到: {file_id}")
-        raise HTTPException(status_code=404, detail="File ID not found.")
+    df = await _load_dataframe(file_id)
 
     if column_name not in df.columns:
-        logger.error(f"❌ 列名未找到: {column_name}")
+        log.error("❌ 列名未找到: %s", column_name)
         raise HTTPException(status_code=404, detail=f"Column '{column_name}' not found in data.")
 
     try:
-        # 获取唯一值，排除NaN
-        unique_values = df[column_name].dropna().unique().tolist()
-        logger.info(f"✅ 获取到 {len(unique_values)} 个唯一值")
+        # 获取唯一值，排除NaN；低基数列直接使用列统计目录中缓存的唯一值
+        unique_values = _get_column_catalog(file_id, df)[column_name]["unique_values"]
+        if unique_values is None:
+            unique_values = df[column_name].dropna().unique().tolist()
+        log.info("✅ 获取到 %d 个唯一值", len(unique_values))
 
         return {
             "values": unique_values,
@@ -470,60 +3201,133 @@ async def get_unique_values(file_id: str, column_name: str):
         }
 
     except Exception as e:
-        logger.error(f"❌ 获取唯一值失败: {str(e)}")
+        log.error("❌ 获取唯一值失败: %s", e)
         raise HTTPException(status_code=500, detail=f"Error getting unique values: {e}")
 
+@app.get("/api/columns/{file_id}")
+async def get_column_catalog(file_id: str):
+    """
+    Returns the precomputed per-column statistics of a file.
+    """
+    logger.info(f"📊 请求获取列统计信息: {file_id}")
+
+    df = await _load_dataframe(file_id)
+    catalog = _get_column_catalog(file_id, df)
+
+    return {
+        "file_id": file_id,
+        "rows": len(df),
+        "columns": list(catalog.values())
+    }
+
+@app.get("/api/memory")
+def get_memory_report():
+    """
+    Returns memory usage by file and by column, including derived caches, with the configured quotas.
+    Files are sorted by the memory they hold, largest first.
+    """
+    _sync_shared_files()
+
+    files = []
+    for file_id in _stored_file_ids():
+        metadata = file_metadata.get(file_id, {})
+        frame = data_storage.frame_info(file_id)
+        column_bytes = metadata.get("column_bytes") or {}
+        files.append({
+            "file_id": file_id,
+            "filename": metadata.get("original_filename"),
+            "sheet_name": metadata.get("sheet_name"),
+            "status": metadata.get("status", "ready"),
+            "memory_bytes": frame["bytes"] if frame else 0,
+            "resident": frame["resident"] if frame else False,
+            # 共享同一数据的其他文件，其内存只计算一次
+            "shared_with": [key for key in frame["keys"] if key != file_id] if frame else [],
+            "versions_bytes": _versions_bytes(file_id),
+            "catalog_bytes": _catalog_bytes(file_id),
+            "filter_index_bytes": _filter_index_bytes(file_id),
+            "filter_cache_bytes": filter_cache.file_bytes(file_id),
+            "columns": dict(sorted(column_bytes.items(), key=lambda item: item[1], reverse=True))
+        })
+    files.sort(key=lambda info: info["memory_bytes"] + info["versions_bytes"] + info["catalog_bytes"]
+               + info["filter_index_bytes"] + info["filter_cache_bytes"], reverse=True)
+
+    datasets_bytes = data_storage.total_bytes()
+    versions_bytes = _versions_bytes()
+    catalog_bytes = sum(info["catalog_bytes"] for info in files)
+    filter_index_bytes = sum(info["filter_index_bytes"] for info in files)
+    return {
+        "total_bytes": datasets_bytes + versions_bytes + catalog_bytes + filter_index_bytes + filter_cache.bytes,
+        "datasets_bytes": datasets_bytes,
+        "resident_bytes": data_storage.resident_bytes,
+        "versions_bytes": versions_bytes,
+        "catalog_bytes": catalog_bytes,
+        "filter_index_bytes": filter_index_bytes,
+        "filter_cache_bytes": filter_cache.bytes,
+        "quotas": {
+            "file_bytes": FILE_QUOTA_BYTES or None,
+            "global_bytes": GLOBAL_QUOTA_BYTES or None,
+            "memory_budget_bytes": MEMORY_BUDGET_BYTES or None
+        },
+        "files": files
+    }
+
+@app.get("/api/metrics")
+def get_metrics():
+    """
+    Returns runtime counters of the dataset store, the filter result cache and the expiry sweeper.
+    """
+    return {
+        "dataset_store": data_storage.stats(),
+        "filter_cache": filter_cache.stats(),
+        "expiry": expiry_stats
+    }
+
 @app.post("/api/predict")
 async def generate_prediction(payload: PredictionPayload):
     """
     使用机器学习算法生成趋势预测
     """
-    logger.info(f"🤖 [预测] 开始预测，文件ID: {payload.file_id}, 算法: {payload.method}")
+    log = SampledLogger(logger, "predict")
+    log.info("🤖 [预测] 开始预测，文件ID: %s, 算法: %s", payload.file_id, payload.method)
 
-    df = data_storage.get(payload.file_id)
-    if df is None:
-        raise HTTPException(status_code=404, detail="File ID not found.")
+    df = await _load_dataframe(payload.file_id)
 
     try:
         # 应用筛选条件
-        filtered_df = df.copy()
-        logger.info(f"📊 [预测] 原始数据形状: {df.shape}")
-        logger.info(f"🔍 [预测] 筛选条件: {payload.filters}")
-
-        for column, values in payload.filters.items():
-            if column in filtered_df.columns and values:
-                before_count = len(filtered_df)
-                filtered_df = filtered_df[filtered_df[column].isin(values)]
-                after_count = len(filtered_df)
-                logger.info(f"🔍 [预测] 按列 '{column}' 筛选 {values}: {before_count} -> {after_count} 行")
+        log.info("📊 [预测] 原始数据形状: %s", df.shape)
+        log.debug("🔍 [预测] 筛选条件: %s", payload.filters)
 
-        logger.info(f"📊 [预测] 筛选后数据形状: {filtered_df.shape}")
+        rows = _filter_rows(payload.file_id, df, payload.filters, ignore_missing=True,
+                            projection=(payload.x_axis, payload.y_axis))
+        log.info("📊 [预测] 筛选后数据行数: %d", len(df) if rows is None else len(rows))
 
         # 检查轴列是否存在
-        if payload.x_axis not in filtered_df.columns:
+        if payload.x_axis not in df.columns:
             raise HTTPException(status_code=400, detail=f"X-axis column '{payload.x_axis}' not found.")
-        if payload.y_axis not in filtered_df.columns:
+        if payload.y_axis not in df.columns:
             raise HTTPException(status_code=400, detail=f"Y-axis column '{payload.y_axis}' not found.")
 
-        # 提取并清理数据
-        data_clean = filtered_df[[payload.x_axis, payload.y_axis]].dropna()
-        logger.info(f"📊 [预测] 清理后数据点数: {len(data_clean)}")
+        # 提取并清理数据，只收集两个轴列
+        axis_df = df[[payload.x_axis, payload.y_axis]]
+        data_clean = (axis_df if rows is None else axis_df.iloc[rows]).dropna()
+        log.info("📊 [预测] 清理后数据点数: %d", len(data_clean))
 
         if len(data_clean) < 3:
-            logger.error(f"❌ [预测] 数据点不足: {len(data_clean)} < 3")
+            log.error("❌ [预测] 数据点不足: %d < 3", len(data_clean))
             raise HTTPException(status_code=400, detail="Insufficient data points for prediction (minimum 3 required).")
 
-        X = data_clean[payload.x_axis].values.reshape(-1, 1)
-        y = data_clean[payload.y_axis].values
+        # 入库时整数列可能被压缩为int8等窄类型，训练前统一转为float避免溢出
+        X = data_clean[payload.x_axis].to_numpy(dtype=float).reshape(-1, 1)
+        y = data_clean[payload.y_axis].to_numpy(dtype=float)
 
         # 根据算法类型进行预测
-        prediction_result = await perform_ml_prediction(X, y, payload.method, payload.steps)
+        prediction_result = await perform_ml_prediction(X, y, payload.method, payload.steps, log)
 
-        logger.info(f"✅ [预测] 预测完成，算法: {payload.method}, 预测步数: {payload.steps}")
+        log.info("✅ [预测] 预测完成，算法: %s, 预测步数: %d", payload.method, payload.steps)
         return prediction_result
 
     except Exception as e:
-        logger.error(f"❌ [预测] 预测失败: {str(e)}")
+        log.error("❌ [预测] 预测失败: %s", e)
         raise HTTPException(status_code=500, detail=f"Prediction error: {e}")
 
 @app.post("/api/predict_direct")
@@ -531,7 +3335,8 @@ async def generate_direct_prediction(payload: DirectPredictionPayload):
     """
     直接使用提供的x和y数据进行机器学习预测
     """
-    logger.info(f"🤖 [直接预测] 开始预测，算法: {payload.method}, 数据点数: {len(payload.x_values)}")
+    log = SampledLogger(logger, "predict_direct")
+    log.info("🤖 [直接预测] 开始预测，算法: %s, 数据点数: %d", payload.method, len(payload.x_values))
 
     try:
         # 验证数据
@@ -547,20 +3352,21 @@ async def generate_direct_prediction(payload: DirectPredictionPayload):
         y = np.array(payload.y_values)
 
         # 执行预测
-        prediction_result = await perform_ml_prediction(X, y, payload.method, payload.steps)
+        prediction_result = await perform_ml_prediction(X, y, payload.method, payload.steps, log)
 
-        logger.info(f"✅ [直接预测] 预测完成，算法: {payload.method}, 预测步数: {payload.steps}")
+        log.info("✅ [直接预测] 预测完成，算法: %s, 预测步数: %d", payload.method, payload.steps)
         return prediction_result
 
     except Exception as e:
-        logger.error(f"❌ [直接预测] 预测失败: {str(e)}")
+        log.error("❌ [直接预测] 预测失败: %s", e)
         raise HTTPException(status_code=500, detail=f"Direct prediction error: {e}")
 
-async def perform_ml_prediction(X, y, method: str, steps: int) -> PredictionResult:
+async def perform_ml_prediction(X, y, method: str, steps: int, log: Optional[logging.LoggerAdapter] = None) -> PredictionResult:
     """
-    执行机器学习预测
+    执行机器学习预测；日志沿用调用接口的采样决定
     """
-    logger.info(f"🔬 [ML] 开始训练模型，算法: {method}, 数据点数: {len(X)}")
+    log = log or SampledLogger(logger, "predict")
+    log.info("🔬 [ML] 开始训练模型，算法: %s, 数据点数: %d", method, len(X))
 
     # 准备预测的X值
     last_x = X[-1, 0]
@@ -687,7 +3493,7 @@ async def perform_ml_prediction(X, y, method: str, steps: int) -> PredictionResu
             'training_points': len(X)
         }
 
-        logger.info(f"✅ [ML] 模型训练完成，R²: {r2:.4f}, RMSE: {rmse:.4f}")
+        log.info("✅ [ML] 模型训练完成，R²: %.4f, RMSE: %.4f", r2, rmse)
 
         return PredictionResult(
             x_values=future_x.flatten().tolist(),
@@ -699,7 +3505,7 @@ async def perform_ml_prediction(X, y, method: str, steps: int) -> PredictionResu
         )
 
     except Exception as e:
-        logger.error(f"❌ [ML] 模型训练失败: {str(e)}")
+        log.error("❌ [ML] 模型训练失败: %s", e)
         raise HTTPException(status_code=500, detail=f"Model training failed: {e}")
 
 if __name__ == "__main__":
@@ -0,0 +1,14 @@
+"""
+Functions run inside the sheet-parsing worker processes.
+
+Kept apart from main so that spawned workers import only pandas, not the app with its
+logging setup, dataset store and persisted-file restore.
+"""
+import pandas as pd
+
+
+def read_excel_sheet(path: str, sheet_name: str) -> pd.DataFrame:
+    """
+    Reads one sheet of a workbook on disk.
+    """
+    return pd.read_excel(path, sheet_name=sheet_name)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据响应序列化的微基准
+对比原有路径（_to_records + jsonable_encoder + JSONResponse）与按列编码的 _records_json
+
+用法: python back_end/tests/bench_serialization.py [行数]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from back_end.main import _records_json, _to_records
+
+
+def build_frame(rows):
+    """构造包含常见列类型的测试数据"""
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal(rows)
+    x[rng.random(rows) < 0.05] = np.nan
+    return pd.DataFrame({
+        "id": np.arange(rows),
+        "x": x,
+        "y": rng.standard_normal(rows).astype(np.float32),
+        "flag": rng.random(rows) < 0.5,
+        "time": pd.Timestamp("2024-01-01") + pd.to_timedelta(np.arange(rows), unit="s"),
+        "project": pd.Categorical(rng.choice(["项目A", "项目B", "项目C"], rows)),
+        "name": pd.Series(rng.choice(["alpha", "beta", "gamma", None], rows), dtype="str"),
+    })
+
+
+def current_path(df):
+    return JSONResponse(jsonable_encoder(_to_records(df))).body
+
+
+def columnar_path(df):
+    return _records_json(df).encode("utf-8")
+
+
+def measure(function, df, repeat=3):
+    """返回多次运行中的最短耗时（秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(df)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    df = build_frame(rows)
+    print(f"📊 {rows} 行 × {df.shape[1]} 列")
+
+    baseline = measure(current_path, df)
+    optimized = measure(columnar_path, df)
+    print(f"⏱️ 原有路径: {baseline * 1000:.1f} ms")
+    print(f"⚡ 按列编码: {optimized * 1000:.1f} ms ({baseline / optimized:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,20 @@
 import pytest
 from fastapi.testclient import TestClient
+import io
+import json
+import logging
+import queue
+import subprocess
+import time
 import os
+import numpy as np
+import pandas as pd
 
 # Add project root to sys.path
 import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
+from back_end import main
 from back_end.main import app
 
 client = TestClient(app)
@@ -254,3 +263,868 @@ def test_delete_nonexistent_file():
     """Tests deleting a file that doesn't exist."""
     response = client.delete("/api/file/nonexistent_id")
     assert response.status_code == 404
+
+def test_upload_background_job():
+    """Tests the background upload mode, its status endpoint, and expiry of finished jobs."""
+    file_path = os.path.join('test_data', '原始数据_sin_half.xlsx')
+    with open(file_path, 'rb') as f:
+        files = {'file': (os.path.basename(file_path), f, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')}
+        response = client.post("/api/upload", files=files, params={"mode": "background"})
+
+    assert response.status_code == 200
+    job_id = response.json()["job_id"]
+
+    # TestClient runs background tasks before returning, so the job is already finished
+    status_response = client.get(f"/api/upload/status/{job_id}")
+    assert status_response.status_code == 200
+    job = status_response.json()
+
+    assert job["status"] == "completed"
+    assert job["bytes_read"] == os.path.getsize(file_path)
+    assert job["sheets_done"] == job["sheets_total"] == 1
+    assert job["rows_parsed"] > 0
+    assert job["result"]["file_id"] == job["file_ids"][0]
+
+    get_response = client.get(f"/api/file/{job['file_ids'][0]}")
+    assert get_response.status_code == 200
+    assert len(get_response.json()["preview_data"]) == job["rows_parsed"]
+
+    assert client.get("/api/upload/status/nonexistent_job").status_code == 404
+
+    # 已结束的任务在保留期内可查询，超过JOB_TTL_SECONDS后由清理任务移除
+    main._sweep_expired_files(now=time.time() + main.JOB_TTL_SECONDS - 60)
+    assert client.get(f"/api/upload/status/{job_id}").status_code == 200
+    main._sweep_expired_files(now=time.time() + main.JOB_TTL_SECONDS + 60)
+    assert client.get(f"/api/upload/status/{job_id}").status_code == 404
+    assert client.get("/api/metrics").json()["expiry"]["expired_jobs"] >= 1
+
+    # 清空文件时一并移除已结束的任务，进行中的任务保留
+    main.upload_jobs["running_job"] = {"job_id": "running_job", "status": "parsing", "finished_time": None}
+    main.upload_jobs["done_job"] = {"job_id": "done_job", "status": "completed", "finished_time": pd.Timestamp.now().isoformat()}
+    client.delete("/api/files/clear")
+    assert "running_job" in main.upload_jobs and "done_job" not in main.upload_jobs
+    main.upload_jobs.pop("running_job")
+
+def test_upload_multiple_sheets_parallel(monkeypatch):
+    """Tests that multi-sheet workbooks parsed in the process pool keep sheet order and data."""
+    monkeypatch.setattr(main, "PARSE_WORKERS", 2)
+
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        for i in range(3):
+            pd.DataFrame({"x": range(10 * (i + 1)), "y": [i] * (10 * (i + 1))}).to_excel(writer, sheet_name=f"S{i}", index=False)
+    buffer.seek(0)
+
+    files = {'file': ('multi.xlsx', buffer, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')}
+    response = client.post("/api/upload", files=files)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["multiple_sheets"] == True
+    assert [f["sheet_name"] for f in data["files"]] == ["S0", "S1", "S2"]
+    assert [f["rows"] for f in data["files"]] == [10, 20, 30]
+    assert data["files"][2]["preview_data"][0] == {"x": 0, "y": 2}
+
+def test_upload_csv_with_dtype_hints():
+    """Tests CSV ingestion with dtype hints."""
+    csv_bytes = "code,value\n" + "".join(f"{i:03d},{i * 0.5}\n" for i in range(10))
+
+    files = {'file': ('data.csv', io.BytesIO(csv_bytes.encode()), 'text/csv')}
+    response = client.post("/api/upload", files=files, data={"dtypes": '{"code": "str"}'})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["filename"] == "data.csv"
+    assert data["sheet_name"] is None
+    assert data["rows"] == 10
+    assert data["headers"] == ["code", "value"]
+    # The dtype hint keeps the leading zeros of the code column
+    assert data["preview_data"][1] == {"code": "001", "value": 0.5}
+
+    files = {'file': ('data.csv', io.BytesIO(csv_bytes.encode()), 'text/csv')}
+    response = client.post("/api/upload", files=files, data={"dtypes": '["code"]'})
+    assert response.status_code == 400
+
+def test_upload_csv_infers_types_once():
+    """Tests that a CSV column turning non-numeric late in the file is inferred as one type, in both upload modes."""
+    # 行数超过pandas解析器内部的分块大小（随列数减小），类型变化出现在分块边界之后
+    rows = 50000
+    padding = ",0" * 15
+    header = "code" + "".join(f",c{j}" for j in range(15))
+    csv_bytes = (header + "\n" + "".join(f"{i}{padding}\n" for i in range(rows)) + f"abc{padding}\n8{padding}\n").encode()
+
+    file_id = client.post("/api/upload", files={'file': ('mixed.csv', csv_bytes, 'text/csv')}).json()["file_id"]
+    codes = main.data_storage[file_id]["code"]
+    assert {type(value) for value in codes.tolist()} == {str}
+    assert codes.tolist()[-3:] == [str(rows - 1), "abc", "8"]
+
+    # 后台模式经行计数读取；追加一行避免命中重复上传复用
+    job_id = client.post("/api/upload", params={"mode": "background"},
+                         files={'file': ('mixed.csv', csv_bytes + f"9{padding}\n".encode(), 'text/csv')}).json()["job_id"]
+    job = client.get(f"/api/upload/status/{job_id}").json()
+    assert job["rows_parsed"] == rows + 3
+    codes = main.data_storage[job["file_ids"][0]]["code"]
+    assert {type(value) for value in codes.tolist()} == {str}
+    for file_id in (file_id, job["file_ids"][0]):
+        client.delete(f"/api/file/{file_id}")
+
+def test_upload_parquet_and_feather():
+    """Tests Parquet and Arrow/Feather ingestion."""
+    pytest.importorskip("pyarrow")
+    df = pd.DataFrame({"Project": ["a", "b", "a"], "CL": [0.1, 0.2, 0.3]})
+
+    for filename, writer in (("data.parquet", df.to_parquet), ("data.feather", df.to_feather)):
+        buffer = io.BytesIO()
+        writer(buffer)
+        buffer.seek(0)
+
+        files = {'file': (filename, buffer, 'application/octet-stream')}
+        response = client.post("/api/upload", files=files)
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["rows"] == 3
+        assert data["headers"] == ["Project", "CL"]
+
+        filter_response = client.post("/api/filter", json={"file_id": data["file_id"], "filters": {"Project": ["a"]}})
+        assert filter_response.status_code == 200
+        assert [row["CL"] for row in filter_response.json()] == [0.1, 0.3]
+
+def test_upload_invalid_file_type():
+    """Tests that unsupported file types are rejected."""
+    files = {'file': ('notes.txt', io.BytesIO(b"hello"), 'text/plain')}
+    response = client.post("/api/upload", files=files)
+    assert response.status_code == 400
+
+def test_upload_lazy_sheets():
+    """Tests that lazily registered sheets are parsed on first access and then cached."""
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        pd.DataFrame({"x": range(5), "y": range(5)}).to_excel(writer, sheet_name="A", index=False)
+        pd.DataFrame({"x": range(8), "z": range(8)}).to_excel(writer, sheet_name="B", index=False)
+    buffer.seek(0)
+
+    files = {'file': ('lazy.xlsx', buffer, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')}
+    response = client.post("/api/upload", files=files, params={"mode": "lazy"})
+
+    assert response.status_code == 200
+    sheets = response.json()["files"]
+    assert [(f["sheet_name"], f["rows"], f["headers"]) for f in sheets] == [("A", 5, ["x", "y"]), ("B", 8, ["x", "z"])]
+    file_a, file_b = sheets[0]["file_id"], sheets[1]["file_id"]
+    assert file_a not in main.data_storage and file_b not in main.data_storage
+
+    listed = {f["file_id"]: f for f in client.get("/api/files").json()["files"]}
+    assert listed[file_b]["rows"] == 8
+
+    # First access parses and caches the sheet
+    get_response = client.get(f"/api/file/{file_a}")
+    assert get_response.status_code == 200
+    assert len(get_response.json()["preview_data"]) == 5
+    assert file_a in main.data_storage
+    source_path = main.file_metadata[file_b]["source_path"]
+    assert os.path.exists(source_path)
+
+    # Deleting the last unparsed sheet removes the spooled workbook
+    assert client.delete(f"/api/file/{file_b}").status_code == 200
+    assert not os.path.exists(source_path)
+
+def test_upload_preview_mode():
+    """Tests that preview uploads respond with the first rows and finish loading in the background."""
+    buffer = io.BytesIO()
+    pd.DataFrame({"Project": ["preview"] * 50, "x": range(50)}).to_excel(buffer, index=False)
+    buffer.seek(0)
+
+    files = {'file': ('preview.xlsx', buffer, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')}
+    response = client.post("/api/upload", files=files, params={"mode": "preview"})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["status"] == "loading"
+    assert len(data["preview_data"]) == main.PREVIEW_ROWS
+    assert data["preview_data"][0] == {"Project": "preview", "x": 0}
+
+    # TestClient runs the background load before returning
+    listed = {f["file_id"]: f for f in client.get("/api/files").json()["files"]}
+    assert listed[data["file_id"]]["status"] == "ready"
+    assert listed[data["file_id"]]["rows"] == 50
+
+def test_data_endpoint_reports_loading_sheet(monkeypatch):
+    """Tests that data endpoints answer 503 while a sheet is being loaded in the background."""
+    file_id = "loading_test_id"
+    main.file_metadata[file_id] = {"sheet_name": "Sheet1", "source_path": "unused.xlsx", "status": "loading"}
+    lock = main._materialize_locks.setdefault(file_id, main.threading.Lock())
+    lock.acquire()
+    try:
+        response = client.get(f"/api/file/{file_id}")
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+
+        # 等待加载时不阻塞事件循环，其他请求照常响应
+        monkeypatch.setattr(main, "LOAD_WAIT_SECONDS", 1.0)
+        with TestClient(app) as shared_client:
+            waiting = main.threading.Thread(target=shared_client.get, args=(f"/api/file/{file_id}",))
+            waiting.start()
+            time.sleep(0.2)
+            start = time.perf_counter()
+            assert shared_client.get("/api/metrics").status_code == 200
+            assert time.perf_counter() - start < 0.5
+            waiting.join()
+    finally:
+        lock.release()
+        main._materialize_locks.pop(file_id, None)
+        main.file_metadata.pop(file_id, None)
+
+def test_upload_optimizes_dtypes():
+    """Tests that ingest compacts dtypes without changing any returned value."""
+    df = pd.DataFrame({
+        "status": ["open", "closed", None, "open"] * 25,
+        "name": [f"item {i}" for i in range(100)],
+        "count": range(100),
+        "ratio": [0.5, 0.25, None, 1.0] * 25,
+        "precise": [0.1 * i for i in range(100)],
+    })
+    files = {'file': ('compact.csv', io.BytesIO(df.to_csv(index=False).encode()), 'text/csv')}
+    response = client.post("/api/upload", files=files)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["memory_saved_bytes"] > 0
+
+    stored = main.data_storage[data["file_id"]]
+    assert isinstance(stored["status"].dtype, pd.CategoricalDtype)
+    assert stored["count"].dtype == "int8"
+    assert stored["ratio"].dtype == "float32"
+    assert stored["precise"].dtype == "float64"
+
+    rows = client.get(f"/api/file/{data['file_id']}").json()["preview_data"]
+    assert rows[2] == {"status": None, "name": "item 2", "count": 2, "ratio": None, "precise": 0.1 * 2}
+    assert rows[3]["ratio"] == 1.0
+
+    filter_response = client.post("/api/filter", json={"file_id": data["file_id"], "filters": {"status": ["open"]}})
+    assert len(filter_response.json()) == 50
+
+def test_duplicate_upload_shares_frames():
+    """Tests that re-uploading identical content shares one stored frame and respects references on delete."""
+    file_path = os.path.join('test_data', '原始数据_sin_half.xlsx')
+    file_ids = []
+    for name in ("first.xlsx", "second.xlsx"):
+        with open(file_path, 'rb') as f:
+            files = {'file': (name, f, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')}
+            response = client.post("/api/upload", files=files)
+        assert response.status_code == 200
+        file_ids.append(response.json()["file_id"])
+
+    first_id, second_id = file_ids
+    assert first_id != second_id
+    assert main.data_storage[first_id] is main.data_storage[second_id]
+    assert main.file_metadata[second_id]["original_filename"] == "second.xlsx"
+    sheet_hash = main.file_metadata[second_id]["sheet_hash"]
+    assert {first_id, second_id} <= main.shared_frames[sheet_hash]
+
+    # Deleting one copy keeps the other readable
+    assert client.delete(f"/api/file/{first_id}").status_code == 200
+    assert first_id not in main.shared_frames[sheet_hash]
+    assert client.get(f"/api/file/{second_id}").status_code == 200
+
+    # Saving over a copy detaches it from the shared frame
+    save_payload = {"file_id": second_id, "headers": ["a"], "data": [[1]]}
+    assert client.post("/api/save", json=save_payload).status_code == 200
+    assert second_id not in main.shared_frames.get(sheet_hash, set())
+
+def test_column_catalog():
+    """Tests the per-column statistics catalog and its invalidation on save."""
+    df = pd.DataFrame({"status": ["open", "closed", "open", None], "code": ["1", "2", "x", "3"], "value": [1.5, None, 3.0, 4.5]})
+    files = {'file': ('catalog.csv', io.BytesIO(df.to_csv(index=False).encode()), 'text/csv')}
+    file_id = client.post("/api/upload", files=files).json()["file_id"]
+
+    response = client.get(f"/api/columns/{file_id}")
+    assert response.status_code == 200
+    columns = {c["name"]: c for c in response.json()["columns"]}
+
+    assert columns["status"]["null_count"] == 1
+    assert columns["status"]["cardinality"] == 2
+    assert columns["status"]["top_values"][0] == {"value": "open", "count": 2}
+    assert columns["status"]["numeric_count"] == 0
+    assert columns["code"]["numeric_coercible"] == False
+    assert columns["code"]["numeric_count"] == 3
+    assert columns["value"]["numeric"] == True
+    assert (columns["value"]["min"], columns["value"]["max"]) == (1.5, 4.5)
+
+    unique_response = client.get(f"/api/unique_values/{file_id}/status")
+    assert unique_response.json()["values"] == ["open", "closed"]
+
+    save_payload = {"file_id": file_id, "headers": ["status"], "data": [["done"], ["done"]]}
+    assert client.post("/api/save", json=save_payload).status_code == 200
+    columns = client.get(f"/api/columns/{file_id}").json()["columns"]
+    assert [c["name"] for c in columns] == ["status"]
+    assert columns[0]["unique_values"] == ["done"]
+
+    # 重复的表头按位置统计，保存不会失败
+    save_payload = {"file_id": file_id, "headers": ["a", "a", "b"], "data": [[1, "x", 2], [3, "y", 4]]}
+    assert client.post("/api/save", json=save_payload).status_code == 200
+    columns = client.get(f"/api/columns/{file_id}").json()["columns"]
+    assert [c["name"] for c in columns] == ["a", "b"] and columns[0]["numeric"] == True
+
+    assert client.get("/api/columns/nonexistent_id").status_code == 404
+
+def test_dataset_store_spills_least_recently_used(tmp_path):
+    """Tests LRU eviction to per-process spill files, transparent reload, and stale spill cleanup."""
+    # 已退出进程留下的溢出目录在新建存储时被清理
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    stale_dir = tmp_path / f"proc-{exited.pid}"
+    stale_dir.mkdir()
+    (stale_dir / "leftover.arrow").write_bytes(b"x")
+
+    first = pd.DataFrame({"Project": ["a", "b"] * 50, "x": range(100)}).astype({"Project": "category"})
+    second = pd.DataFrame({"y": [0.5] * 100})
+    budget = int(max(first.memory_usage(deep=True).sum(), second.memory_usage(deep=True).sum()))
+    store = main.DatasetStore(budget, str(tmp_path))
+    assert not stale_dir.exists()
+
+    store["first"] = first
+    store["first_copy"] = first
+    store["second"] = second
+
+    stats = store.stats()
+    assert stats["evictions"] == 1
+    assert stats["spilled_frames"] == 1
+    assert store.peek("first") is None and store.peek("first_copy") is None
+    assert "first" in store and len(store) == 3
+
+    reloaded = store.get("first")
+    pd.testing.assert_frame_equal(reloaded, first)
+    assert store.get("first_copy") is reloaded
+    assert store.stats()["misses"] == 1
+    assert store.peek("second") is None
+    assert {path.parent.name for path in tmp_path.rglob("*.arrow")} == {f"proc-{os.getpid()}"}
+
+    # The spill file is removed with the last key referencing the frame
+    store.pop("second")
+    store.clear()
+    assert list(tmp_path.iterdir()) == []
+
+def test_metrics_endpoint():
+    """Tests that dataset store counters are exposed."""
+    response = client.get("/api/metrics")
+    assert response.status_code == 200
+    store_stats = response.json()["dataset_store"]
+    for key in ("hits", "misses", "evictions", "resident_bytes", "memory_budget"):
+        assert key in store_stats
+
+def test_persistent_store_survives_restart(tmp_path):
+    """Tests that a persistent dataset store reopens its datasets and metadata after a restart."""
+    pytest.importorskip("pyarrow")
+    df = pd.DataFrame({"Project": pd.Categorical(["a", "b", "a"]), "x": [1.5, 2.5, 3.5], "n": [1, 2, 3]})
+
+    store = main.DatasetStore(0, str(tmp_path), persistent=True)
+    store["file_1"] = df
+    store["file_2"] = df
+    store.save_metadata("file_1", {"original_filename": "data.xlsx", "rows": 3})
+    store["file_3"] = df.head(1)
+    store.pop("file_3")
+
+    reopened = main.DatasetStore(0, str(tmp_path), persistent=True)
+    restored = reopened.restore()
+
+    assert sorted(restored) == ["file_1", "file_2"]
+    assert restored["file_1"]["original_filename"] == "data.xlsx"
+    assert reopened.peek("file_1") is None
+
+    loaded = reopened.get("file_1")
+    pd.testing.assert_frame_equal(loaded, df)
+    assert reopened.get("file_2") is loaded
+    assert len(list(tmp_path.glob("*.arrow"))) == 1
+
+def test_shared_store_across_workers(tmp_path):
+    """Tests that stores sharing a directory see each other's uploads, saves, deletes and jobs."""
+    pytest.importorskip("pyarrow")
+    worker_1 = main.DatasetStore(0, str(tmp_path), persistent=True)
+    worker_2 = main.DatasetStore(0, str(tmp_path), persistent=True)
+    df = pd.DataFrame({"x": [1.0, 2.0, 3.0]})
+
+    worker_1["file_1"] = df
+    worker_1.save_metadata("file_1", {"rows": 3})
+    assert worker_2.refresh("file_1") == ("updated", {"rows": 3})
+    pd.testing.assert_frame_equal(worker_2["file_1"], df)
+    assert worker_2.refresh("file_1") == ("unchanged", None)
+
+    # 其他进程共享同一数据文件，删除一个引用不会删除文件
+    worker_2["file_2"] = worker_2["file_1"]
+    assert worker_1.refresh_all() == {"file_2": ("updated", {})}
+    worker_1.pop("file_1")
+    assert worker_2.refresh("file_1") == ("removed", None)
+    pd.testing.assert_frame_equal(worker_1["file_2"], df)
+
+    worker_2["file_2"] = df.head(1)
+    assert worker_1.refresh("file_2") == ("updated", {})
+    assert len(worker_1["file_2"]) == 1
+    assert len(list(tmp_path.glob("*.arrow"))) == 1
+
+    # 覆盖保存在一次写入中同时替换数据路径和元数据，不会先删除索引行
+    statements = []
+    worker_1._index.set_trace_callback(statements.append)
+    worker_1.put("file_2", df, {"rows": 3, "version": 2})
+    worker_1._index.set_trace_callback(None)
+    assert not any(statement.startswith("DELETE") for statement in statements)
+    assert worker_2.refresh("file_2") == ("updated", {"rows": 3, "version": 2})
+    pd.testing.assert_frame_equal(worker_2["file_2"], df)
+    assert len(list(tmp_path.glob("*.arrow"))) == 1
+
+    worker_1.save_job({"job_id": "job_1", "status": "parsing"})
+    assert worker_2.load_job("job_1")["status"] == "parsing"
+    worker_1.save_job({"job_id": "job_2", "status": "completed", "finished_time": "2024-01-01T00:00:00"})
+    assert worker_2.remove_jobs("2024-06-01T00:00:00") == 1
+    assert worker_1.load_job("job_2") is None and worker_1.load_job("job_1") is not None
+
+    # 访问时间取所有进程中最近的一次
+    worker_1.record_access("file_2", 100.0)
+    worker_2.record_access("file_2", 50.0)
+    assert worker_2.last_access_times() == {"file_2": 100.0}
+    worker_2.pop("file_2")
+    assert worker_1.last_access_times() == {}
+
+def test_save_creates_copy_on_write_version():
+    """Tests that saves produce new versions sharing unchanged columns, with retained old versions and ETags."""
+    buffer = io.BytesIO()
+    pd.DataFrame({"x": [1.5, 2.5, 3.5], "label": ["a", "b", "c"]}).to_csv(buffer, index=False)
+    files = {'file': ('versioned.csv', buffer.getvalue(), 'text/csv')}
+    upload_data = client.post("/api/upload", files=files).json()
+    file_id = upload_data["file_id"]
+    assert upload_data["version"] == 1
+    original = main.data_storage[file_id]
+
+    save_payload = {"file_id": file_id, "headers": ["x", "label"], "data": [[1.5, "a"], [2.5, "B"], [3.5, "c"]]}
+    response = client.post("/api/save", json=save_payload)
+    assert response.status_code == 200
+    assert response.json()["version"] == 2
+    assert response.json()["changed_columns"] == ["label"]
+    assert response.headers["ETag"] == f'"{file_id}-v2"'
+
+    # 未修改的列与上一版本共享缓冲区，上一版本保持不变
+    saved = main.data_storage[file_id]
+    assert np.shares_memory(saved["x"].to_numpy(), original["x"].to_numpy())
+    assert original["label"].tolist() == ["a", "b", "c"]
+
+    current = client.get(f"/api/file/{file_id}")
+    assert current.json()["version"] == 2
+    assert client.get(f"/api/file/{file_id}", headers={"If-None-Match": current.headers["ETag"]}).status_code == 304
+
+    previous = client.get(f"/api/file/{file_id}", params={"version": 1})
+    assert previous.status_code == 200
+    assert previous.json()["preview_data"][1]["label"] == "b"
+    assert client.get(f"/api/file/{file_id}", params={"version": 7}).status_code == 404
+
+    # 通过保存新建的文件，每次保存同样递增版本
+    new_id = f"saved-{file_id}"
+    first = client.post("/api/save", json={**save_payload, "file_id": new_id})
+    assert first.json()["version"] == 1
+    second = client.post("/api/save", json={**save_payload, "file_id": new_id})
+    assert second.json()["version"] == 2 and second.headers["ETag"] != first.headers["ETag"]
+    assert client.get(f"/api/file/{new_id}", headers={"If-None-Match": first.headers["ETag"]}).status_code == 200
+
+def test_memory_report_and_quotas(monkeypatch):
+    """Tests the per-file and per-column memory report and that uploads over quota are rejected."""
+    buffer = io.BytesIO()
+    pd.DataFrame({"x": np.arange(1000, dtype=float), "label": ["row"] * 1000}).to_csv(buffer, index=False)
+    files = {'file': ('memory.csv', buffer.getvalue(), 'text/csv')}
+    file_id = client.post("/api/upload", files=files).json()["file_id"]
+
+    report = client.get("/api/memory").json()
+    assert report["datasets_bytes"] == main.data_storage.total_bytes()
+    entry = next(info for info in report["files"] if info["file_id"] == file_id)
+    assert entry["memory_bytes"] == main.data_storage.frame_info(file_id)["bytes"]
+    assert entry["columns"]["x"] == main.data_storage[file_id]["x"].memory_usage(deep=True, index=False)
+    assert entry["catalog_bytes"] > 0
+
+    other = io.BytesIO()
+    pd.DataFrame({"y": np.arange(1000, dtype=float)}).to_csv(other, index=False)
+    monkeypatch.setattr(main, "FILE_QUOTA_BYTES", 1000)
+    response = client.post("/api/upload", files={'file': ('too_big.csv', other.getvalue(), 'text/csv')})
+    assert response.status_code == 413
+
+    monkeypatch.setattr(main, "FILE_QUOTA_BYTES", 0)
+    monkeypatch.setattr(main, "GLOBAL_QUOTA_BYTES", main.data_storage.total_bytes() + 100)
+    response = client.post("/api/upload", files={'file': ('too_big.csv', other.getvalue(), 'text/csv')})
+    assert response.status_code == 507
+    assert not any(meta.get("original_filename") == "too_big.csv" for meta in main.file_metadata.values())
+
+def test_sweeper_removes_expired_files(monkeypatch):
+    """Tests that the expiry sweep removes idle files by their TTL and reports it in metrics."""
+    def upload(name, **params):
+        buffer = io.BytesIO()
+        pd.DataFrame({"name": [name], "value": [len(name)]}).to_csv(buffer, index=False)
+        response = client.post("/api/upload", params=params, files={'file': (f'{name}.csv', buffer.getvalue(), 'text/csv')})
+        return response.json()["file_id"]
+
+    idle_id = upload("idle_file", idle_ttl_seconds=60)
+    kept_id = upload("kept_file")
+    swept_before = main.expiry_stats["expired_files"]
+
+    # 访问会刷新闲置计时
+    assert main._sweep_expired_files(now=time.time() + 30) == 0
+    assert client.get(f"/api/file/{idle_id}").status_code == 200
+    main._sweep_expired_files(now=time.time() + 90)
+
+    assert client.get(f"/api/file/{idle_id}").status_code == 404
+    assert client.get(f"/api/file/{kept_id}").status_code == 200
+
+    # 上传后的绝对过期时间同样按传入的now计算
+    aged_id = upload("aged_file", ttl_seconds=60)
+    main._sweep_expired_files(now=time.time() + 30)
+    assert aged_id in main._stored_file_ids()
+    main._sweep_expired_files(now=time.time() + 90)
+    assert aged_id not in main._stored_file_ids()
+    metrics = client.get("/api/metrics").json()["expiry"]
+    assert metrics["expired_files"] == swept_before + 2
+    assert metrics["reclaimed_bytes"] > 0
+
+    # 共享存储中其他worker的读取同样刷新闲置计时
+    shared_id = upload("shared_file", idle_ttl_seconds=60)
+    monkeypatch.setattr(main, "SHARED_STORE", True)
+    monkeypatch.setattr(main.data_storage, "last_access_times", lambda: {shared_id: time.time() + 80})
+    main._sweep_expired_files(now=time.time() + 90)
+    assert shared_id in main._stored_file_ids()
+    monkeypatch.setattr(main, "SHARED_STORE", False)
+
+    monkeypatch.setattr(main, "SWEEP_INTERVAL_SECONDS", 0.01)
+    monkeypatch.setattr(main, "ABSOLUTE_TTL_SECONDS", 0.01)
+    with TestClient(app) as lifespan_client:
+        time.sleep(0.2)
+        assert lifespan_client.get(f"/api/file/{kept_id}").status_code == 404
+
+def test_filter_index_matches_string_and_numeric_keys():
+    """Tests that indexed filtering keeps the direct/string/numeric matching rules and is rebuilt on save."""
+    buffer = io.BytesIO()
+    pd.DataFrame({
+        "tag": ["1", "a", "1.0", "b", "a", "1"],
+        "z": [10, 20, 10, 30, 10, 20],
+        "w": [0.5, None, 1.5, 0.5, None, 2.5],
+    }).to_csv(buffer, index=False)
+    files = {'file': ('indexed.csv', buffer.getvalue(), 'text/csv')}
+    file_id = client.post("/api/upload", files=files).json()["file_id"]
+
+    def filter_rows(filters):
+        response = client.post("/api/filter", json={"file_id": file_id, "filters": filters})
+        assert response.status_code == 200
+        return [(row["tag"], row["z"]) for row in response.json()]
+
+    # 数字匹配多于直接匹配时，"1"同时匹配"1"和"1.0"
+    assert filter_rows({"tag": ["1"]}) == [("1", 10), ("1.0", 10), ("1", 20)]
+    assert filter_rows({"tag": ["a"]}) == [("a", 20), ("a", 10)]
+    # 后续列的匹配数量在前一列筛选后的行上计算，数量相同时优先数字匹配
+    assert filter_rows({"z": ["10"], "tag": ["a", "1"]}) == [("1", 10), ("1.0", 10)]
+    assert filter_rows({"z": ["20"], "tag": ["a", "b"]}) == [("a", 20)]
+    assert filter_rows({"w": ["nan"]}) == [("a", 20), ("a", 10)]
+    assert filter_rows({"z": ["99"]}) == []
+    assert main.filter_indexes[file_id]["version"] == 1
+
+    save_payload = {"file_id": file_id, "headers": ["tag", "z", "w"], "data": [["a", 10, 0.5], ["c", 10, 0.5]]}
+    assert client.post("/api/save", json=save_payload).status_code == 200
+    assert file_id not in main.filter_indexes
+    assert filter_rows({"tag": ["c"]}) == [("c", 10)]
+
+def test_plot_data_uses_bitmap_indexes():
+    """Tests that multi-column filters on low-cardinality columns intersect per-value bitmaps."""
+    rows = 1000
+    frame = pd.DataFrame({
+        "region": [["north", "south", "east"][i % 3] for i in range(rows)],
+        "grade": [["A", "B"][i % 2] for i in range(rows)],
+        "x": np.arange(rows, dtype=float),
+        "y": np.arange(rows, dtype=float) * 2,
+    })
+    buffer = io.BytesIO()
+    frame.to_csv(buffer, index=False)
+    file_id = client.post("/api/upload", files={'file': ('bitmaps.csv', buffer.getvalue(), 'text/csv')}).json()["file_id"]
+
+    filters = {"region": ["north", "east"], "grade": ["A"]}
+    payload = {"file_id": file_id, "filters": filters, "x_axis": "x", "y_axis": "y"}
+    response = client.post("/api/plot_data", json=payload)
+    assert response.status_code == 200
+
+    expected = frame[frame["region"].isin(filters["region"]) & frame["grade"].isin(filters["grade"])]
+    assert response.json()["x_values"] == expected["x"].tolist()
+    assert response.json()["y_values"] == expected["y"].tolist()
+
+    index = main.filter_indexes[file_id]["columns"]["region"]
+    assert index.uses_bitmaps("direct", main.data_storage[file_id]["region"])
+    assert index.nbytes() > 0
+
+    response = client.post("/api/plot_data", json={**payload, "filters": {"missing": ["a"]}})
+    assert response.status_code == 400
+
+def test_filter_result_cache():
+    """Tests that repeated filters hit the row-position cache and that saves invalidate it."""
+    buffer = io.BytesIO()
+    pd.DataFrame({"group": ["a", "b", "a", "c"], "x": [1.0, 2.0, 3.0, 4.0], "y": [1.0, 4.0, 9.0, 16.0]}).to_csv(buffer, index=False)
+    file_id = client.post("/api/upload", files={'file': ('cached.csv', buffer.getvalue(), 'text/csv')}).json()["file_id"]
+    hits_before = main.filter_cache.counters["hits"]
+
+    first = client.post("/api/filter", json={"file_id": file_id, "filters": {"group": ["a"]}}).json()
+    # 值的顺序和重复不影响缓存键
+    second = client.post("/api/filter", json={"file_id": file_id, "filters": {"group": ["a", "a"]}}).json()
+    assert first == second == [{"group": "a", "x": 1.0, "y": 1.0}, {"group": "a", "x": 3.0, "y": 9.0}]
+
+    plot_payload = {"file_id": file_id, "filters": {"group": ["c", "b"]}, "x_axis": "x", "y_axis": "y"}
+    client.post("/api/plot_data", json=plot_payload)
+    plot = client.post("/api/plot_data", json={**plot_payload, "filters": {"group": ["b", "c"]}}).json()
+    assert plot["x_values"] == [2.0, 4.0]
+    assert main.filter_cache.counters["hits"] == hits_before + 2
+    assert main.filter_cache.file_bytes(file_id) > 0
+
+    save_payload = {"file_id": file_id, "headers": ["group", "x", "y"], "data": [["a", 5.0, 25.0]]}
+    assert client.post("/api/save", json=save_payload).status_code == 200
+    assert main.filter_cache.file_bytes(file_id) == 0
+    assert client.post("/api/filter", json={"file_id": file_id, "filters": {"group": ["a"]}}).json() == [{"group": "a", "x": 5.0, "y": 25.0}]
+
+    metrics = client.get("/api/metrics").json()["filter_cache"]
+    assert metrics["hits"] >= 2 and metrics["hit_rate"] is not None
+
+def test_paginated_filter_and_file(monkeypatch):
+    """Tests offset/limit and cursor pagination of /api/filter and /api/file with total counts."""
+    buffer = io.BytesIO()
+    pd.DataFrame({"group": ["a", "b"] * 25, "n": range(50)}).to_csv(buffer, index=False)
+    file_id = client.post("/api/upload", files={'file': ('paged.csv', buffer.getvalue(), 'text/csv')}).json()["file_id"]
+    monkeypatch.setattr(main, "MAX_PAGE_ROWS", 10)
+
+    payload = {"file_id": file_id, "filters": {"group": ["a"]}, "limit": 100}
+    collected = []
+    page = client.post("/api/filter", json=payload).json()
+    assert page["total"] == 25 and page["limit"] == 10
+    while True:
+        collected.extend(row["n"] for row in page["rows"])
+        if page["next_cursor"] is None:
+            break
+        page = client.post("/api/filter", json={**payload, "cursor": page["next_cursor"]}).json()
+    assert collected == list(range(0, 50, 2))
+
+    page = client.post("/api/filter", json={**payload, "offset": 20, "limit": 3}).json()
+    assert [row["n"] for row in page["rows"]] == [40, 42, 44]
+
+    file_page = client.get(f"/api/file/{file_id}", params={"offset": 45, "limit": 10}).json()
+    assert file_page["total_rows"] == 50
+    assert [row["n"] for row in file_page["preview_data"]] == [45, 46, 47, 48, 49]
+    assert file_page["next_cursor"] is None
+
+    first_page = client.get(f"/api/file/{file_id}", params={"limit": 5}).json()
+    other_filter = {"file_id": file_id, "filters": {"group": ["b"]}, "cursor": first_page["next_cursor"]}
+    assert client.post("/api/filter", json=other_filter).status_code == 400
+
+    # 数据保存后旧游标失效
+    save_payload = {"file_id": file_id, "headers": ["group", "n"], "data": [["a", 1]]}
+    assert client.post("/api/save", json=save_payload).status_code == 200
+    response = client.get(f"/api/file/{file_id}", params={"cursor": first_page["next_cursor"]})
+    assert response.status_code == 409
+
+def test_column_projection():
+    """Tests that filter and file requests can be limited to a subset of columns."""
+    buffer = io.BytesIO()
+    pd.DataFrame({"group": ["a", "b", "a"], "x": [1, 2, 3], "y": [4, 5, 6], "z": ["p", "q", "r"]}).to_csv(buffer, index=False)
+    file_id = client.post("/api/upload", files={'file': ('wide.csv', buffer.getvalue(), 'text/csv')}).json()["file_id"]
+
+    payload = {"file_id": file_id, "filters": {"group": ["a"]}, "columns": ["y", "x", "y"]}
+    response = client.post("/api/filter", json=payload)
+    assert response.status_code == 200
+    assert response.json() == [{"y": 4, "x": 1}, {"y": 6, "x": 3}]
+
+    file_data = client.get(f"/api/file/{file_id}", params={"columns": ["z", "x"]}).json()
+    assert file_data["headers"] == ["z", "x"]
+    assert file_data["preview_data"][0] == {"z": "p", "x": 1}
+
+    response = client.post("/api/filter", json={**payload, "columns": ["missing"]})
+    assert response.status_code == 400
+
+def test_filter_expression_tree():
+    """Tests range, membership, null and text operators combined with and/or/not."""
+    buffer = io.BytesIO()
+    pd.DataFrame({
+        "name": ["alpha", "beta", "gamma", "delta", None],
+        "x": [1.0, 2.5, 4.0, None, 10.0],
+        "group": ["a", "b", "a", "b", "c"],
+    }).to_csv(buffer, index=False)
+    file_id = client.post("/api/upload", files={'file': ('expressions.csv', buffer.getvalue(), 'text/csv')}).json()["file_id"]
+
+    def names(where, filters=None):
+        response = client.post("/api/filter", json={"file_id": file_id, "filters": filters or {}, "where": where})
+        assert response.status_code == 200, response.text
+        return [row["name"] for row in response.json()]
+
+    assert names({"column": "x", "op": "between", "value": [2, 5]}) == ["beta", "gamma"]
+    assert names({"column": "x", "op": ">", "value": 100}) == []
+    assert names({"column": "x", "op": "is null"}) == ["delta"]
+    assert names({"column": "name", "op": "contains", "value": "ta"}) == ["beta", "delta"]
+    assert names({"column": "group", "op": "not in", "value": ["a"]}) == ["beta", "delta", None]
+    assert names({"op": "or", "args": [
+        {"column": "x", "op": "<", "value": 2},
+        {"op": "and", "args": [{"column": "group", "op": "==", "value": "b"},
+                               {"op": "not", "args": [{"column": "x", "op": "is null"}]}]},
+    ]}) == ["alpha", "beta"]
+    # 与按值筛选组合
+    assert names({"column": "x", "op": ">=", "value": 2}, filters={"group": ["a"]}) == ["gamma"]
+
+    plot = client.post("/api/plot_data", json={"file_id": file_id, "filters": {}, "x_axis": "x", "y_axis": "x",
+                                               "where": {"column": "x", "op": "<=", "value": 2.5}}).json()
+    assert plot["x_values"] == [1.0, 2.5]
+
+    for where in ({"column": "x", "op": "~", "value": 1}, {"column": "missing", "op": "is null"},
+                  {"column": "x", "op": ">", "value": "abc"}, {"op": "not", "args": []},
+                  {"column": "group", "op": "==", "value": None}, {"column": "group", "op": "in", "value": ["a", None]},
+                  {"column": "x", "op": "between", "value": [None, 5]}):
+        response = client.post("/api/filter", json={"file_id": file_id, "filters": {}, "where": where})
+        assert response.status_code == 400
+
+def test_columnar_format():
+    """Tests the negotiated columnar JSON format of filter, file and upload responses."""
+    buffer = io.BytesIO()
+    pd.DataFrame({"group": ["a", "b", "a"], "x": [1.5, None, 3.0], "n": [1, 2, 3]}).to_csv(buffer, index=False)
+    columnar = {"Accept": main.COLUMNAR_MEDIA_TYPE}
+    assert main._to_columns(pd.DataFrame({"x": [np.inf, -np.inf, 1.0]}))["data"]["x"] == [None, None, 1.0]
+    response = client.post("/api/upload", files={'file': ('columnar.csv', buffer.getvalue(), 'text/csv')}, headers=columnar)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith(main.COLUMNAR_MEDIA_TYPE)
+    upload = response.json()
+    assert upload["preview_data"] == {"columns": ["group", "x", "n"],
+                                      "data": {"group": ["a", "b", "a"], "x": [1.5, None, 3.0], "n": [1, 2, 3]}}
+    file_id = upload["file_id"]
+
+    response = client.post("/api/filter", json={"file_id": file_id, "filters": {"group": ["a"]}}, headers=columnar)
+    assert "Accept" in response.headers["vary"]
+    assert response.json() == {"columns": ["group", "x", "n"], "data": {"group": ["a", "a"], "x": [1.5, 3.0], "n": [1, 3]}}
+
+    page = client.post("/api/filter", params={"format": "columnar"},
+                       json={"file_id": file_id, "filters": {}, "limit": 2}).json()
+    assert page["data"]["x"] == [1.5, None] and page["total"] == 3 and page["next_cursor"] is not None
+
+    file_data = client.get(f"/api/file/{file_id}", params={"format": "columnar", "columns": ["n"]})
+    assert file_data.headers["etag"]
+    assert file_data.json()["preview_data"] == {"columns": ["n"], "data": {"n": [1, 2, 3]}}
+
+    # 未协商时仍返回按行的列表
+    records = client.get(f"/api/file/{file_id}")
+    assert isinstance(records.json()["preview_data"], list)
+    assert "Accept" in records.headers["vary"]
+
+    # 不同格式、列和分页的ETag不同，不会用一种表示的缓存重新验证另一种
+    etags = {records.headers["etag"], file_data.headers["etag"]}
+    for params in ({"format": "columnar"}, {"columns": ["n"]}, {"limit": 2}, {"limit": 2, "offset": 1}):
+        etags.add(client.get(f"/api/file/{file_id}", params=params).headers["etag"])
+    assert len(etags) == 6
+    revalidated = client.get(f"/api/file/{file_id}", params={"format": "columnar"},
+                             headers={"If-None-Match": records.headers["etag"]})
+    assert revalidated.status_code == 200
+    assert client.get(f"/api/file/{file_id}", params={"format": "xml"}).status_code == 400
+
+def test_binary_responses():
+    """Tests Arrow IPC and Float64 buffer responses of filter, file and plot data requests."""
+    buffer = io.BytesIO()
+    pd.DataFrame({"group": ["a", "b", "a", "a"], "x": [1.0, 2.0, None, 4.0], "y": [10, 20, 30, 40]}).to_csv(buffer, index=False)
+    file_id = client.post("/api/upload", files={'file': ('binary.csv', buffer.getvalue(), 'text/csv')}).json()["file_id"]
+
+    plot_payload = {"file_id": file_id, "filters": {"group": ["a"]}, "x_axis": "x", "y_axis": "y"}
+    response = client.post("/api/plot_data", json=plot_payload, headers={"Accept": main.FLOAT64_MEDIA_TYPE})
+    assert response.headers["content-type"] == main.FLOAT64_MEDIA_TYPE
+    assert response.headers["x-row-count"] == "2"
+    values = np.frombuffer(response.content, dtype="<f8")
+    assert values.tolist() == [1.0, 4.0, 10.0, 30.0]
+    assert client.post("/api/plot_data", json=plot_payload).json()["x_values"] == [1.0, 4.0]
+
+    response = client.post("/api/filter", json={"file_id": file_id, "filters": {}, "columns": ["x", "y"], "limit": 3},
+                           params={"format": "float64"})
+    assert response.headers["x-total-count"] == "4" and response.headers["x-next-cursor"]
+    values = np.frombuffer(response.content, dtype="<f8")
+    assert np.isnan(values[2]) and values[[0, 1, 3, 4, 5]].tolist() == [1.0, 2.0, 10.0, 20.0, 30.0]
+    response = client.post("/api/filter", json={"file_id": file_id, "filters": {}}, params={"format": "float64"})
+    assert response.status_code == 406
+
+    pa = pytest.importorskip("pyarrow")
+    response = client.get(f"/api/file/{file_id}", headers={"Accept": main.ARROW_STREAM_MEDIA_TYPE})
+    assert response.headers["etag"]
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.column_names == ["group", "x", "y"]
+    assert table.column("group").to_pylist() == ["a", "b", "a", "a"]
+    assert table.column("x").to_pylist()[:2] == [1.0, 2.0] and table.column("x").to_pylist()[2] is None
+
+def test_ndjson_streaming(monkeypatch):
+    """Tests NDJSON streaming of file and filter rows in batches."""
+    buffer = io.BytesIO()
+    pd.DataFrame({"group": ["a", "b"] * 5, "n": range(10), "x": [0.5, None] * 5}).to_csv(buffer, index=False)
+    file_id = client.post("/api/upload", files={'file': ('stream.csv', buffer.getvalue(), 'text/csv')}).json()["file_id"]
+    monkeypatch.setattr(main, "STREAM_BATCH_ROWS", 3)
+
+    with client.stream("GET", f"/api/file/{file_id}", headers={"Accept": main.NDJSON_MEDIA_TYPE}) as response:
+        assert response.headers["content-type"].startswith(main.NDJSON_MEDIA_TYPE)
+        assert response.headers["x-row-count"] == "10" and response.headers["etag"]
+        rows = [json.loads(line) for line in response.iter_lines() if line]
+    assert rows == client.get(f"/api/file/{file_id}").json()["preview_data"]
+
+    response = client.post("/api/filter", json={"file_id": file_id, "filters": {"group": ["b"]}, "columns": ["n", "x"]},
+                           params={"format": "ndjson"})
+    assert [json.loads(line) for line in response.text.splitlines()] == [{"n": n, "x": None} for n in (1, 3, 5, 7, 9)]
+
+def test_records_json_matches_records():
+    """Tests that the column-wise JSON serializer encodes the same values as the records path."""
+    df = pd.DataFrame({
+        "n": [1, 2, 3],
+        "x%": [0.5, np.nan, np.inf],
+        "f32": np.array([0.1, 2.0, -3.5], dtype=np.float32),
+        "flag": [True, False, True],
+        "when": pd.to_datetime(["2024-01-01 08:00:00", None, "2024-01-02 00:00:00.5"], format="ISO8601"),
+        "name": pd.Series(['a"b', None, "中文\n"], dtype="str"),
+        "group": pd.Categorical(["p", None, "q"]),
+        "mixed": [1, "x", pd.Timestamp("2021-01-02")],
+    })
+    expected = main._to_records(df)
+    expected[2]["x%"] = None  # 原有路径无法编码inf
+    assert json.loads(main._records_json(df)) == json.loads(json.dumps(main.jsonable_encoder(expected)))
+    assert json.loads(main._records_json(df.iloc[[2, 0]])) == json.loads(main._records_json(df))[::-2]
+
+def test_sampled_structured_logging(monkeypatch, caplog):
+    """Tests per-endpoint log sampling, debug-only diagnostics and the JSON log formatter."""
+    buffer = io.BytesIO()
+    pd.DataFrame({"group": ["a", "b"], "n": [1, 2]}).to_csv(buffer, index=False)
+    file_id = client.post("/api/upload", files={'file': ('logging.csv', buffer.getvalue(), 'text/csv')}).json()["file_id"]
+    payload = {"file_id": file_id, "filters": {"group": ["a"]}}
+
+    monkeypatch.setattr(main, "LOG_SAMPLE_RATES", {"filter": 0})
+    with caplog.at_level(logging.INFO, logger=main.logger.name):
+        assert client.post("/api/filter", json=payload).status_code == 200
+        assert client.post("/api/filter", json={**payload, "filters": {"missing": ["x"]}}).status_code == 400
+    filter_records = [record for record in caplog.records if getattr(record, "endpoint", None) == "filter"]
+    assert [record.levelname for record in filter_records] == ["ERROR"]
+
+    caplog.clear()
+    monkeypatch.setattr(main, "LOG_SAMPLE_RATES", {})
+    with caplog.at_level(logging.INFO, logger=main.logger.name):
+        client.post("/api/filter", json=payload)
+    assert caplog.records and not any("样本数据" in record.getMessage() for record in caplog.records)
+    caplog.clear()
+    with caplog.at_level(logging.DEBUG, logger=main.logger.name):
+        # 换一个筛选值，避免命中筛选结果缓存
+        client.post("/api/filter", json={**payload, "filters": {"group": ["b"]}})
+    assert any("样本数据" in record.getMessage() for record in caplog.records)
+
+    record = logging.makeLogRecord({"name": "daplot", "levelno": logging.INFO, "levelname": "INFO",
+                                    "msg": "rows: %d", "args": (3,), "endpoint": "filter"})
+    entry = json.loads(main.JsonLogFormatter().format(record))
+    assert entry["message"] == "rows: 3" and entry["endpoint"] == "filter" and entry["level"] == "INFO"
+
+    # 其他高频接口同样按接口采样
+    caplog.clear()
+    monkeypatch.setattr(main, "LOG_SAMPLE_RATES", {"predict": 0, "save": 0, "unique_values": 0})
+    with caplog.at_level(logging.INFO, logger=main.logger.name):
+        client.get(f"/api/unique_values/{file_id}/group")
+        client.post("/api/save", json={"file_id": file_id, "headers": ["group", "n"], "data": [["a", 1], ["b", 2]]})
+        client.post("/api/predict", json={"file_id": file_id, "filters": {}, "x_axis": "n", "y_axis": "n", "method": "linear", "steps": 1})
+    endpoint_records = [record for record in caplog.records if hasattr(record, "endpoint")]
+    assert {record.endpoint for record in endpoint_records} == {"predict"}
+    assert all(record.levelname == "ERROR" for record in endpoint_records)
+
+    # 经队列输出时保留异常信息，由JSON格式化器写入exception字段
+    log_queue = queue.SimpleQueue()
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = main.logger.makeRecord("daplot", logging.ERROR, __file__, 0, "failed: %s", ("x",), sys.exc_info())
+    main._DeferredQueueHandler(log_queue).handle(record)
+    entry = json.loads(main.JsonLogFormatter().format(log_queue.get_nowait()))
+    assert entry["message"] == "failed: x" and "ValueError: boom" in entry["exception"]
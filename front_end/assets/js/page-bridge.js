@@ -33,6 +33,129 @@ class PageBridge {
         return baseUrl + '/api' + cleanEndpoint;
     }
 
+    // 分页拉取筛选结果，服务端每次只序列化一页
+    async fetchFilteredRows(url, body, pageSize = 10000) {
+        const rows = [];
+        let cursor = null;
+        do {
+            const response = await fetch(url, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    // 列式格式不重复每行的列名，传输体积更小
+                    'Accept': 'application/vnd.daplot.columnar+json'
+                },
+                body: JSON.stringify({ ...body, limit: pageSize, cursor: cursor })
+            });
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+
+            const page = await response.json();
+            const length = page.columns.length ? page.data[page.columns[0]].length : 0;
+            for (let i = 0; i < length; i++) {
+                const row = {};
+                for (const column of page.columns) {
+                    row[column] = page.data[column][i];
+                }
+                rows.push(row);
+            }
+            cursor = page.next_cursor;
+        } while (cursor);
+        return rows;
+    }
+
+    // 拉取绘图数据；数值坐标轴以Float64缓冲区传输，x_values/y_values为Float64Array，可直接交给Plotly
+    async fetchPlotData(url, body) {
+        const request = (accept) => fetch(url, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': accept
+            },
+            body: JSON.stringify(body)
+        });
+
+        let response = await request('application/vnd.daplot.float64');
+        if (response.status === 406) {
+            // 非数值坐标轴无法以Float64传输，退回JSON
+            response = await request('application/json');
+        }
+        if (!response.ok) {
+            const errorText = await response.text();
+            console.error('API响应错误:', response.status, errorText);
+            throw new Error(`HTTP error! status: ${response.status} ${errorText}`);
+        }
+
+        if (!response.headers.get('Content-Type').startsWith('application/vnd.daplot.float64')) {
+            return response.json();
+        }
+        const buffer = await response.arrayBuffer();
+        const count = Number(response.headers.get('X-Row-Count'));
+        const [xLabel, yLabel] = JSON.parse(response.headers.get('X-Plot-Labels'));
+        return {
+            x_values: new Float64Array(buffer, 0, count),
+            y_values: new Float64Array(buffer, count * 8, count),
+            x_label: xLabel,
+            y_label: yLabel
+        };
+    }
+
+    // 拉取文件信息和全部行：行数据以NDJSON流式接收，每收到一批行调用onRows(batch, receivedCount)
+    async fetchFileData(url, onRows = null) {
+        const separator = url.includes('?') ? '&' : '?';
+        const infoResponse = await fetch(`${url}${separator}limit=1`);
+        if (!infoResponse.ok) {
+            throw new Error(`HTTP error! status: ${infoResponse.status}`);
+        }
+        const fileData = await infoResponse.json();
+        fileData.preview_data = await this.streamRows(`${url}${separator}version=${fileData.version}`, {}, onRows);
+        delete fileData.total_rows;
+        delete fileData.offset;
+        delete fileData.limit;
+        delete fileData.next_cursor;
+        return fileData;
+    }
+
+    // 以NDJSON流式读取行，无需等待整个响应；每解析出一批完整的行就回调onRows
+    async streamRows(url, options = {}, onRows = null) {
+        const response = await fetch(url, {
+            ...options,
+            headers: {
+                ...(options.headers || {}),
+                'Accept': 'application/x-ndjson'
+            }
+        });
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+
+        const rows = [];
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let pending = '';
+        const consume = (text) => {
+            const lines = text.split('\n');
+            pending = lines.pop();
+            const batch = lines.filter(line => line).map(line => JSON.parse(line));
+            for (const row of batch) {
+                rows.push(row);
+            }
+            if (onRows && batch.length > 0) {
+                onRows(batch, rows.length);
+            }
+        };
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) {
+                break;
+            }
+            consume(pending + decoder.decode(value, { stream: true }));
+        }
+        consume(pending + decoder.decode() + '\n');
+        return rows;
+    }
+
     // 设置API基础地址
     setApiBaseUrl(url) {
         this.apiBaseUrl = url;